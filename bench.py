@@ -0,0 +1,177 @@
+from __future__ import annotations
+
+import json
+import platform
+import random
+import socket
+import subprocess
+import sys
+from dataclasses import asdict
+from dataclasses import dataclass
+from dataclasses import field
+from datetime import datetime
+from importlib.metadata import PackageNotFoundError
+from importlib.metadata import version
+from pathlib import Path
+from statistics import median
+from statistics import stdev
+from uuid import uuid4
+
+
+def _package_version(name: str) -> str | None:
+    try:
+        return version(name)
+    except PackageNotFoundError:
+        return None
+
+
+def _git_revision(path: Path) -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty", "--tags"],
+            cwd=path,
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def get_environment() -> dict:
+    import django
+    import voteit
+
+    voteit_path = Path(voteit.__file__).parent
+    return {
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "host": socket.gethostname(),
+        "django": django.get_version(),
+        "voteit": _package_version("voteit"),
+        "voteit_git": _git_revision(voteit_path),
+        "voteit_tools_git": _git_revision(Path(__file__).parent),
+    }
+
+
+@dataclass
+class BenchCase:
+    timings: list[float] = field(default_factory=list)
+    queries: list[int] = field(default_factory=list)
+    sizes: list[int] = field(default_factory=list)
+
+
+@dataclass
+class BenchRun:
+    """
+    Results from one run of a bench command, stored as a line in a JSON-lines file.
+    """
+
+    command: str
+    label: str = ""
+    args: dict = field(default_factory=dict)
+    id: str = field(default_factory=lambda: uuid4().hex[:8])
+    created: str = field(default_factory=lambda: datetime.now().isoformat())
+    environment: dict = field(default_factory=dict)
+    cases: dict[str, BenchCase] = field(default_factory=dict)
+
+    def add(
+        self,
+        case: str,
+        seconds: float,
+        queries: int | None = None,
+        size: int | None = None,
+    ):
+        item = self.cases.setdefault(case, BenchCase())
+        item.timings.append(seconds)
+        if queries is not None:
+            item.queries.append(queries)
+        if size is not None:
+            item.sizes.append(size)
+
+    def save(self, fn: str):
+        if not self.environment:
+            self.environment = get_environment()
+        with open(fn, "a") as stream:
+            stream.write(json.dumps(asdict(self)) + "\n")
+
+    @classmethod
+    def from_dict(cls, data: dict) -> BenchRun:
+        data = dict(data)
+        data["cases"] = {k: BenchCase(**v) for k, v in data["cases"].items()}
+        return cls(**data)
+
+
+def load_runs(fn: str) -> list[BenchRun]:
+    with open(fn) as stream:
+        return [BenchRun.from_dict(json.loads(line)) for line in stream if line.strip()]
+
+
+def permutation_test(a: list[float], b: list[float], rounds: int = 5000) -> float:
+    """
+    Two sided p-value for the difference in median between a and b.
+    Needs no assumptions about the distribution, which suits timings.
+    """
+    observed = abs(median(b) - median(a))
+    pooled = a + b
+    rnd = random.Random(0)
+    hits = 0
+    for _ in range(rounds):
+        rnd.shuffle(pooled)
+        if abs(median(pooled[len(a) :]) - median(pooled[: len(a)])) >= observed:
+            hits += 1
+    return (hits + 1) / (rounds + 1)
+
+
+@dataclass
+class CaseDiff:
+    case: str
+    before: float
+    after: float
+    before_stdev: float | None
+    after_stdev: float | None
+    change: float
+    p_value: float | None
+    queries_before: int | None
+    queries_after: int | None
+    size_before: int | None
+    size_after: int | None
+
+    def is_regression(self, threshold: float, alpha: float) -> bool:
+        if self.change < threshold:
+            return False
+        # Without repeated samples we can't tell noise from change
+        return self.p_value is not None and self.p_value < alpha
+
+
+def compare_runs(before: BenchRun, after: BenchRun) -> list[CaseDiff]:
+    def _last(values):
+        return values[-1] if values else None
+
+    def _stdev(values):
+        return stdev(values) if len(values) > 1 else None
+
+    diffs = []
+    for case, a in before.cases.items():
+        if (b := after.cases.get(case)) is None:
+            continue
+        med_a, med_b = median(a.timings), median(b.timings)
+        p_value = None
+        if len(a.timings) > 1 and len(b.timings) > 1:
+            p_value = permutation_test(a.timings, b.timings)
+        diffs.append(
+            CaseDiff(
+                case=case,
+                before=med_a,
+                after=med_b,
+                before_stdev=_stdev(a.timings),
+                after_stdev=_stdev(b.timings),
+                change=(med_b - med_a) / med_a if med_a else 0.0,
+                p_value=p_value,
+                queries_before=_last(a.queries),
+                queries_after=_last(b.queries),
+                size_before=_last(a.sizes),
+                size_after=_last(b.sizes),
+            )
+        )
+    return diffs
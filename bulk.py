@@ -0,0 +1,176 @@
+from __future__ import annotations
+
+import json
+from copy import deepcopy
+from collections.abc import Iterable
+
+from auditlog.context import disable_auditlog
+from auditlog.models import LogEntry
+from auditlog.registry import auditlog
+from django.contrib.contenttypes.models import ContentType
+from django.db import models
+from django.db import router
+from django.db.models.signals import m2m_changed
+from django.db.models.signals import post_save
+from django.utils import timezone
+from django_fsm import TransitionNotAllowed
+from django_fsm import can_proceed
+
+
+def bulk_log(
+    objs: list[models.Model],
+    action: int,
+    changes: dict[int, dict] | None = None,
+    actor=None,
+):
+    """
+    Write audit log entries for objs in one insert, if their model is registered.
+    changes is a map of pk -> {field: [old, new]}.
+    """
+    if not objs or not auditlog.contains(objs[0].__class__):
+        return
+    content_type = ContentType.objects.get_for_model(objs[0].__class__)
+    # Older auditlog versions store changes as text
+    as_text = LogEntry._meta.get_field("changes").get_internal_type() == "TextField"
+    entries = []
+    for obj in objs:
+        obj_changes = (changes or {}).get(obj.pk, {})
+        entries.append(
+            LogEntry(
+                content_type=content_type,
+                object_pk=str(obj.pk),
+                object_id=obj.pk,
+                object_repr=str(obj)[:200],
+                action=action,
+                changes=json.dumps(obj_changes) if as_text else obj_changes,
+                actor=actor,
+            )
+        )
+    LogEntry.objects.bulk_create(entries)
+
+
+def send_post_save(objs: list[models.Model], created: bool, update_fields=None):
+    """
+    Fire post_save for objects written with bulk operations, so receivers
+    that notify clients still run. Audit logging is handled by bulk_log instead.
+    """
+    with disable_auditlog():
+        for obj in objs:
+            post_save.send(
+                sender=obj.__class__,
+                instance=obj,
+                created=created,
+                update_fields=update_fields,
+                raw=False,
+                using=router.db_for_write(obj.__class__, instance=obj),
+            )
+
+
+def transition_target(obj: models.Model, transition: str) -> str | None:
+    """
+    State obj would end up in after transition, without running it.
+    """
+    meta = getattr(obj, transition)._django_fsm
+    found = meta.get_transition(getattr(obj, meta.field.name))
+    return found.target if found else None
+
+
+def bulk_transition(
+    objs: list[models.Model],
+    transition: str,
+    actor=None,
+    state_field: str = "state",
+    batch_size: int = 500,
+):
+    """
+    Run a workflow transition in memory on all objects and store them
+    with bulk_update. Every field the transition changes is written, plus auto_now
+    fields. Raises TransitionNotAllowed before anything is changed
+    if any object can't make the transition.
+    """
+    if not objs:
+        return
+    if blocked := [x for x in objs if not can_proceed(getattr(x, transition))]:
+        raise TransitionNotAllowed(
+            f"Can't {transition} {', '.join(str(x.pk) for x in blocked)}"
+        )
+    model = objs[0].__class__
+    concrete = [f for f in model._meta.concrete_fields if not f.primary_key]
+    # auto_now fields aren't touched by bulk_update
+    auto_now = [f.name for f in concrete if getattr(f, "auto_now", False)]
+    now = timezone.now()
+    fields = {state_field}
+    changes = {}
+    for obj in objs:
+        before = {f.name: deepcopy(getattr(obj, f.attname)) for f in concrete}
+        getattr(obj, transition)()
+        changes[obj.pk] = obj_changes = {}
+        for f in concrete:
+            value = getattr(obj, f.attname)
+            if value != before[f.name]:
+                fields.add(f.name)
+                obj_changes[f.name] = [str(before[f.name]), str(value)]
+        for name in auto_now:
+            setattr(obj, name, now)
+    fields.update(auto_now)
+    fields = sorted(fields)
+    model.objects.bulk_update(objs, fields, batch_size=batch_size)
+    bulk_log(objs, LogEntry.Action.UPDATE, changes=changes, actor=actor)
+    send_post_save(objs, created=False, update_fields=frozenset(fields))
+
+
+def bulk_create(
+    model: type[models.Model],
+    objs: list[models.Model],
+    actor=None,
+    batch_size: int = 500,
+) -> list[models.Model]:
+    """
+    bulk_create that also writes audit entries and fires post_save.
+    Requires a database that returns primary keys, like PostgreSQL.
+    """
+    if not objs:
+        return []
+    created = model.objects.bulk_create(objs, batch_size=batch_size)
+    bulk_log(created, LogEntry.Action.CREATE, actor=actor)
+    send_post_save(created, created=True)
+    return created
+
+
+def bulk_add_m2m(
+    model: type[models.Model],
+    field_name: str,
+    values: dict[models.Model, Iterable[int]],
+    batch_size: int = 1000,
+):
+    """
+    Insert through rows for a many to many field for several objects at once,
+    and fire m2m_changed pre_add and post_add for each object like add() would.
+    """
+    field = model._meta.get_field(field_name)
+    through = field.remote_field.through
+    src, dst = field.m2m_field_name(), field.m2m_reverse_field_name()
+    values = {obj: set(pks) for obj, pks in values.items()}
+
+    def _send(action):
+        for obj, pks in values.items():
+            m2m_changed.send(
+                sender=through,
+                instance=obj,
+                action=action,
+                reverse=False,
+                model=field.related_model,
+                pk_set=pks,
+                using=router.db_for_write(through, instance=obj),
+            )
+
+    _send("pre_add")
+    through.objects.bulk_create(
+        [
+            through(**{f"{src}_id": obj.pk, f"{dst}_id": pk})
+            for obj, pks in values.items()
+            for pk in pks
+        ],
+        batch_size=batch_size,
+    )
+    _send("post_add")
@@ -0,0 +1,58 @@
+from __future__ import annotations
+
+import json
+from collections.abc import Callable
+from collections.abc import Iterable
+from pathlib import Path
+
+from django.db import transaction
+
+
+def chunked(items: list, size: int):
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
+
+class ChunkProgress:
+    """
+    Pks or other stable keys that have been committed, stored as JSON after each chunk
+    so an interrupted run can be resumed with the same file.
+    """
+
+    def __init__(self, fn: str | None = None):
+        self.fn = fn
+        self.done: set[int | str] = set()
+        if fn and Path(fn).exists():
+            with open(fn) as stream:
+                self.done.update(json.load(stream))
+
+    def add(self, pks: Iterable[int | str]):
+        self.done.update(pks)
+        if self.fn:
+            with open(self.fn, "w") as stream:
+                json.dump(sorted(self.done), stream)
+
+
+def process_in_chunks(
+    pks: Iterable[int | str],
+    chunk_size: int,
+    func: Callable[[list[int | str]], object],
+    commit: bool,
+    progress: ChunkProgress | None = None,
+):
+    """
+    Call func with chunks of pks, each in a short transaction of its own.
+    Without commit every chunk is rolled back, which previews the run chunk by chunk.
+    Yields (chunk, result) after each chunk.
+    """
+    pks = sorted(pks)
+    if progress:
+        pks = [x for x in pks if x not in progress.done]
+    for chunk in chunked(pks, chunk_size):
+        with transaction.atomic(durable=True):
+            result = func(chunk)
+            if not commit:
+                transaction.set_rollback(True)
+        if commit and progress:
+            progress.add(chunk)
+        yield chunk, result
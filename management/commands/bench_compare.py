@@ -0,0 +1,93 @@
+from django.core.management import BaseCommand
+
+from voteit_tools.bench import compare_runs
+from voteit_tools.bench import load_runs
+
+
+class Command(BaseCommand):
+    help = "Compare two benchmark runs saved with --save"
+
+    def add_arguments(self, parser):
+        parser.add_argument("file", help="JSON-lines file with saved runs")
+        parser.add_argument(
+            "runs",
+            help="Run ids or index in file (-1 is last). Defaults to the last two runs.",
+            nargs="*",
+            default=["-2", "-1"],
+        )
+        parser.add_argument(
+            "--threshold",
+            help="Percent slower to count as regression",
+            type=float,
+            default=10.0,
+        )
+        parser.add_argument(
+            "--alpha",
+            help="Significance level for regressions",
+            type=float,
+            default=0.05,
+        )
+        parser.add_argument(
+            "--list", help="List saved runs", action="store_true", default=False
+        )
+
+    def get_run(self, runs, value):
+        for run in runs:
+            if run.id == value:
+                return run
+        try:
+            return runs[int(value)]
+        except (ValueError, IndexError):
+            exit(f"No run matching {value}")
+
+    def handle(self, *args, **options):
+        runs = load_runs(options["file"])
+        if options["list"]:
+            for i, run in enumerate(runs):
+                self.stdout.write(
+                    f"{i:>3} {run.id} {run.created} {run.command} {run.label} "
+                    f"voteit: {run.environment.get('voteit')} ({run.environment.get('voteit_git')})"
+                )
+            return
+        if len(options["runs"]) != 2:
+            exit("Specify exactly two runs")
+        before, after = (self.get_run(runs, x) for x in options["runs"])
+        if before.command != after.command:
+            self.stdout.write(
+                self.style.WARNING(
+                    f"Comparing different commands: {before.command} and {after.command}"
+                )
+            )
+        for title, run in (("Before", before), ("After", after)):
+            self.stdout.write(
+                f"{title}: {run.id} {run.created} {run.label} - "
+                f"voteit: {run.environment.get('voteit')} ({run.environment.get('voteit_git')})"
+            )
+        threshold = options["threshold"] / 100
+        regressions = 0
+        for diff in compare_runs(before, after):
+            msg = (
+                f"{diff.case}".ljust(50)
+                + f"{diff.before:.4f} -> {diff.after:.4f} secs".ljust(28)
+                + f"{diff.change:+.1%}".ljust(10)
+            )
+            if diff.p_value is not None:
+                msg += f"p={diff.p_value:.3f} ".ljust(10)
+            if diff.queries_before != diff.queries_after:
+                msg += f"Queries: {diff.queries_before} -> {diff.queries_after} "
+            if diff.size_before != diff.size_after:
+                msg += f"Size: {diff.size_before} -> {diff.size_after}"
+            if diff.is_regression(threshold, options["alpha"]):
+                regressions += 1
+                msg = self.style.ERROR(msg)
+            elif diff.change >= threshold:
+                msg = self.style.WARNING(msg)
+            elif diff.change <= -threshold:
+                msg = self.style.SUCCESS(msg)
+            self.stdout.write(msg)
+        if regressions:
+            self.stdout.write(
+                self.style.ERROR(f"{regressions} significant regression(s)")
+            )
+        else:
+            self.stdout.write(self.style.SUCCESS("No significant regressions"))
@@ -1,3 +1,5 @@
+from collections import defaultdict
+
 from auditlog.context import set_actor
 from django.core.management import BaseCommand
 from django.db import models
@@ -5,8 +7,16 @@ from django.db import transaction
 
 from voteit.meeting.models import Meeting
 from voteit.poll.app.polls.combined_simple import CombinedSimple
+from voteit.poll.models import Poll
 from voteit.poll.utils import get_poll_method_registry
+from voteit.proposal.models import Proposal
+from voteit_tools.bulk import bulk_add_m2m
+from voteit_tools.bulk import bulk_create
+from voteit_tools.bulk import bulk_transition
+from voteit_tools.management.utils import add_chunk_arguments
 from voteit_tools.management.utils import get_user
+from voteit_tools.management.utils import run_chunks
+from voteit_tools.utils import exectime
 
 
 class Command(BaseCommand):
@@ -29,6 +39,7 @@ class Command(BaseCommand):
         parser.add_argument(
             "--commit", help="Commit result to db", action="store_true", default=False
         )
+        add_chunk_arguments(parser)
         reg = get_poll_method_registry()
         parser.add_argument("--method", choices=reg.keys(), default=CombinedSimple.name)
 
@@ -45,37 +56,68 @@ class Command(BaseCommand):
                 "proposals", filter=models.Q(proposals__state="published")
             )
         )
-        no_prop_ai_qs = ai_qs.filter(proposals_pub_count=0)
-        if no_prop_ai_qs.exists():
+        ais = list(ai_qs)
+        if no_prop_ais := [x for x in ais if not x.proposals_pub_count]:
             self.stdout.write(
                 self.style.WARNING(
                     "The following agenda items contain no proposals in published state, so they will be removed:"
                 )
             )
-            for ai in no_prop_ai_qs:
+            for ai in no_prop_ais:
                 self.stdout.write(ai.title)
-            ai_qs = ai_qs.difference(no_prop_ai_qs)
-        if ai_qs.count():
+            ais = [x for x in ais if x.proposals_pub_count]
+        if ais:
             self.stdout.write(
-                f"Found {ai_qs.count()} agenda items in meeting {meeting.title}"
+                f"Found {len(ais)} agenda items in meeting {meeting.title}"
             )
         else:
             exit("No agenda items found, aborting")
         commit = options.get("commit")
         user = get_user(options["u"], meeting)
-        body = options.get("txt", "")
-        with transaction.atomic(durable=True):
+        body = options.get("txt") or ""
+
+        def _create(ais):
+            prop_pks = defaultdict(list)
+            for ai_pk, prop_pk in Proposal.objects.filter(
+                agenda_item__in=[x.pk for x in ais]
+            ).values_list("agenda_item_id", "pk"):
+                prop_pks[ai_pk].append(prop_pk)
             with set_actor(user):
-                for ai in ai_qs:
-                    poll = meeting.polls.create(
-                        agenda_item=ai,
-                        title=f"{ai.title[:67]} 1",
-                        method_name=options["method"],
-                        body=body,
+                with exectime() as et:
+                    polls = bulk_create(
+                        Poll,
+                        [
+                            Poll(
+                                meeting=meeting,
+                                agenda_item=ai,
+                                title=f"{ai.title[:67]} 1",
+                                method_name=options["method"],
+                                body=body,
+                            )
+                            for ai in ais
+                        ],
+                        actor=user,
+                    )
+                    bulk_add_m2m(
+                        Poll,
+                        "proposals",
+                        {x: prop_pks[x.agenda_item_id] for x in polls},
                     )
-                    poll.proposals.add(*ai.proposals.all())
-                    poll.upcoming()
-                    poll.save()
+                    bulk_transition(polls, "upcoming", actor=user)
+            return f"created {len(polls)} polls - {len(polls) / et():.0f} polls/sec"
+
+        if options["chunk_size"]:
+            ai_map = {ai.pk: ai for ai in ais}
+            run_chunks(
+                self,
+                ai_map,
+                lambda chunk: _create([ai_map[x] for x in chunk]),
+                options,
+                title="agenda items",
+            )
+            return
+        with transaction.atomic(durable=True):
+            self.stdout.write(_create(ais))
             if commit:
                 self.stdout.write(self.style.SUCCESS("All done, saving"))
             else:
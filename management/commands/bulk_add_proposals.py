@@ -1,11 +1,72 @@
+import csv
+from dataclasses import dataclass
+from dataclasses import fields
+from functools import reduce
+from operator import or_
+
 from auditlog.context import set_actor
 from django.core.management import BaseCommand
+from django.db import models
 from django.db import transaction
 
 from voteit.meeting.models import Meeting
 from voteit.proposal.models import Proposal
+from voteit_tools.bulk import bulk_create
+from voteit_tools.management.utils import add_chunk_arguments
 from voteit_tools.management.utils import get_group
 from voteit_tools.management.utils import get_user
+from voteit_tools.management.utils import run_chunks
+from voteit_tools.proposals import PropIdAllocator
+from voteit_tools.proposals import mk_proposal
+from voteit_tools.utils import exectime
+
+
+@dataclass
+class ProposalRow:
+    """
+    One row in a --file. Select agenda items with pk, title (starts with) or tag.
+    """
+
+    txt: str
+    pk: int | None = None
+    title: str | None = None
+    tag: str | None = None
+    user: str | None = None
+    group: str | None = None
+
+    def matches(self, ai: dict) -> bool:
+        if self.pk is not None:
+            return ai["pk"] == self.pk
+        if self.title is not None:
+            return ai["title"].startswith(self.title)
+        if self.tag is not None:
+            return self.tag in ai["tags"]
+        return False
+
+
+def read_rows(fn: str) -> list[ProposalRow]:
+    with open(fn) as stream:
+        if fn.endswith((".yaml", ".yml")):
+            try:
+                import yaml
+            except ImportError:
+                exit("Install pyyaml to read YAML files")
+            items = yaml.safe_load(stream)
+        else:
+            items = list(csv.DictReader(stream))
+    names = {f.name for f in fields(ProposalRow)}
+    rows = []
+    for i, item in enumerate(items, start=1):
+        item = {k: v for k, v in item.items() if k in names and v not in ("", None)}
+        if not item.get("txt"):
+            exit(f"Row {i} in {fn} has no txt")
+        if "pk" in item:
+            item["pk"] = int(item["pk"])
+        row = ProposalRow(**item)
+        if row.pk is None and row.title is None and row.tag is None:
+            exit(f"Row {i} in {fn} needs pk, title or tag")
+        rows.append(row)
+    return rows
 
 
 class Command(BaseCommand):
@@ -23,55 +84,139 @@ class Command(BaseCommand):
         # )
         parser.add_argument(
             "-u",
-            help="User to add proposals, specify as PK or userid",
-            required=True,
+            help="User to add proposals, specify as PK or userid. Default for rows in --file.",
         )
         parser.add_argument(
             "-g",
             help="Group to add proposals, uses as_group. Specify as pk or groupid",
         )
-        parser.add_argument("--txt", help="Proposal text, use HTML!", required=True)
+        parser.add_argument("--txt", help="Proposal text, use HTML!")
+        parser.add_argument(
+            "--file",
+            help="CSV or YAML with columns txt, pk/title/tag to select agenda items, "
+            "and optionally user and group. Replaces -s and --txt.",
+        )
         parser.add_argument(
             "--commit", help="Commit result to db", action="store_true", default=False
         )
+        parser.add_argument(
+            "--allow-unmatched",
+            help="Continue even if some rows in --file match no agenda item",
+            action="store_true",
+            default=False,
+        )
+        add_chunk_arguments(parser)
+
+    def get_rows(self, options) -> list[ProposalRow]:
+        if options["file"]:
+            if options["txt"] or options["s"]:
+                exit("Use either --file or -s/--txt")
+            return read_rows(options["file"])
+        if not options["txt"]:
+            exit("Specify --txt or --file")
+        return [ProposalRow(txt=options["txt"], title=options["s"] or "")]
 
     def handle(self, *args, **options):
         meeting: Meeting = Meeting.objects.get(pk=options.get("m"))
-        ai_qs = meeting.agenda_items.all()
-        txt = options["txt"]
-        # Not needed right now
-        # if tags := options.get("t", []):
-        #     ai_qs = ai_qs.filter(tags__overlap=tags)
-        if ai_title_start := options.get("s"):
-            ai_qs = ai_qs.filter(title__startswith=ai_title_start)
-        # Avoid duplicate proposals
-        existing_prop_ai_pks = Proposal.objects.filter(
-            agenda_item__in=ai_qs, body__contains=txt
-        ).values_list("agenda_item_id", flat=True)
-        if existing_prop_ai_pks.count():
+        rows = self.get_rows(options)
+        # All agenda items in one query, matched in memory
+        ais = list(meeting.agenda_items.values("pk", "title", "tags"))
+        # Avoid duplicate proposals, check all texts in one query
+        texts = {x.txt for x in rows}
+        existing = {}
+        for ai_pk, body in Proposal.objects.filter(
+            reduce(or_, (models.Q(body__contains=x) for x in texts)),
+            agenda_item__meeting=meeting,
+        ).values_list("agenda_item_id", "body"):
+            existing.setdefault(ai_pk, []).append(body)
+        # Users and groups are resolved once per distinct value
+        users, groups = {}, {}
+        # Keyed by agenda item and row, stable between runs so --progress can resume
+        items = {}
+        ignored = 0
+        unmatched = []
+        for row_index, row in enumerate(rows):
+            user_value = row.user or options["u"]
+            if not user_value:
+                exit(f"No user for '{row.txt[:30]}', specify -u or a user column")
+            if user_value not in users:
+                users[user_value] = get_user(user_value, meeting)
+            group = None
+            if group_value := row.group or options["g"]:
+                if group_value not in groups:
+                    groups[group_value] = get_group(group_value, meeting)
+                group = groups[group_value]
+            matched = False
+            for ai in ais:
+                if not row.matches(ai):
+                    continue
+                matched = True
+                if any(row.txt in body for body in existing.get(ai["pk"], ())):
+                    ignored += 1
+                    continue
+                items[f"{ai['pk']}:{row_index}"] = (
+                    ai["pk"],
+                    row.txt,
+                    users[user_value],
+                    group,
+                )
+            if not matched:
+                unmatched.append((row_index + 1, row))
+        if unmatched:
+            for number, row in unmatched:
+                selector = ", ".join(
+                    f"{name}={value!r}"
+                    for name in ("pk", "title", "tag")
+                    if (value := getattr(row, name)) is not None
+                )
+                self.stderr.write(
+                    self.style.ERROR(
+                        f"Row {number} matches no agenda item: {selector} '{row.txt[:30]}'"
+                    )
+                )
+            if not options["allow_unmatched"]:
+                exit(
+                    f"{len(unmatched)} rows match no agenda item, "
+                    f"fix them or specify --allow-unmatched"
+                )
+        if ignored:
             self.stdout.write(
                 self.style.WARNING(
-                    f"There are already proposals within {existing_prop_ai_pks.count()} of the agenda items that matches the same text, they will be ignored"
+                    f"There are already proposals within {ignored} of the agenda items that matches the same text, they will be ignored"
                 )
             )
-            ai_qs = ai_qs.exclude(pk__in=existing_prop_ai_pks)
-        if ai_qs.count():
+        if items:
             self.stdout.write(
-                f"Found {ai_qs.count()} agenda items in meeting {meeting.title}"
+                f"Found {len(items)} proposals to add to "
+                f"{len({x[0] for x in items.values()})} agenda items in meeting {meeting.title}"
             )
         else:
             exit("No agenda items found, aborting")
         commit = options.get("commit")
-        user = get_user(options["u"], meeting)
-        if group := options.get("g"):
-            group = get_group(group, meeting)
+
+        def _create(keys):
+            allocator = PropIdAllocator(meeting)
+            by_user = {}
+            for key in keys:
+                ai_pk, txt, user, group = items[key]
+                by_user.setdefault(user, []).append(
+                    mk_proposal(allocator, ai_pk, txt, user, meeting_group=group)
+                )
+            created = []
+            with exectime() as et:
+                for user, proposals in by_user.items():
+                    with set_actor(user):
+                        created.extend(bulk_create(Proposal, proposals, actor=user))
+                allocator.verify()
+            return (
+                f"created {len(created)} proposals - {len(created) / et():.0f} rows/sec"
+            )
+
+        if options["chunk_size"]:
+            run_chunks(self, list(items), _create, options, title="proposals")
+            return
         with transaction.atomic(durable=True):
-            with set_actor(user):
-                prop_kwargs = {"author": user}
-                if group:
-                    prop_kwargs.update({"meeting_group": group, "as_group": True})
-                for ai in ai_qs:
-                    ai.proposals.create(body=txt, **prop_kwargs)
+            self.stdout.write(_create(list(items)))
             if commit:
                 self.stdout.write(self.style.SUCCESS("All done, saving"))
             else:
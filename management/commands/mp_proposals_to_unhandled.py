@@ -1,15 +1,20 @@
 from auditlog.context import set_actor
-from django.contrib.contenttypes.models import ContentType
 from django.core.management import BaseCommand
-from django.db import models
 from django.db import transaction
 
 from voteit.agenda.workflows import AgendaItemWf
 from voteit.meeting.models import Meeting
 from voteit.proposal.models import Proposal
 from voteit.proposal.workflows import ProposalWf
-from voteit.reactions.models import Reaction
 from voteit.reactions.models import ReactionButton
+from voteit_tools.bulk import bulk_transition
+from voteit_tools.management.utils import add_chunk_arguments
+from voteit_tools.management.utils import add_plan_arguments
+from voteit_tools.management.utils import run_chunks
+from voteit_tools.management.utils import run_plan
+from voteit_tools.management.utils import show_plan
+from voteit_tools.plan import Plan
+from voteit_tools.thresholds import ReactionTable
 
 
 class Command(BaseCommand):
@@ -61,6 +66,8 @@ class Command(BaseCommand):
             action="store_true",
             default=False,
         )
+        add_chunk_arguments(parser)
+        add_plan_arguments(parser)
 
     def handle(self, *args, **options):
         meeting: Meeting = Meeting.objects.get(pk=options.get("m"))
@@ -71,7 +78,6 @@ class Command(BaseCommand):
         )
         if not republish_target_btn.target:
             exit("(-p) Återpublicera-knappen måste ha target satt.")
-        button_ids = options["b"] + options["d"]
         btns = meeting.reaction_buttons.filter(pk__in=options["b"], flag_mode=True)
         if btns.count() != len(options["b"]):
             exit("(-b) Knapp-IDn stämmer inte med mötesknappar i flagg-läge.")
@@ -96,6 +102,8 @@ class Command(BaseCommand):
         else:
             denied_btns = []
         user = meeting.participants.get(pk=options.get("u"))
+        if options["from_plan"]:
+            return run_plan(self, "mp_proposals_to_unhandled", meeting, user, options)
         if options["ai"]:
             ai_qs = meeting.agenda_items.filter(pk__in=options["ai"])
         else:
@@ -108,96 +116,73 @@ class Command(BaseCommand):
         prop_qs = Proposal.objects.filter(
             agenda_item__in=ai_qs, state=ProposalWf.PUBLISHED
         )
-        # Find proposals that match specific flags
-        if denied_btns:
-            set_deny_object_ids = Reaction.objects.filter(
-                button__in=denied_btns,
-                object_id__in=prop_qs.values("pk"),
-                content_type=ContentType.objects.get_for_model(Proposal),
-            ).values_list("object_id", flat=True)
-        else:
-            set_deny_object_ids = []
-        relevant_proposal_ids = Reaction.objects.filter(
-            button__in=button_ids,
-            object_id__in=prop_qs.values("pk"),
-            content_type=ContentType.objects.get_for_model(Proposal),
-        ).values_list("object_id", flat=True)
-        if verbose:
-            self.stdout.write(
-                f"Found {relevant_proposal_ids.count()} proposals pre filtering"
-            )
-        # Find reactions over target
         self.stdout.write(
             f"Target for {republish_target_btn} is {republish_target_btn.target}"
         )
-        over_target_proposal_ids = (
-            republish_target_btn.reactions.filter(
-                object_id__in=prop_qs.values("pk"),
-                content_type=ContentType.objects.get_for_model(Proposal),
-            )
-            .values("object_id")
-            .order_by()
-            .annotate(count=models.Count("pk"))
-            .filter(count__gte=republish_target_btn.target)
-        )
-        self.stdout.write(
-            f"Found {over_target_proposal_ids.count()} proposals over target."
-        )
-        relevant_proposal_ids = relevant_proposal_ids.exclude(
-            object_id__in=over_target_proposal_ids.values("object_id")
+        table = ReactionTable.load(
+            prop_qs,
+            [republish_target_btn, *options["b"], *denied_btns, *ignore_btns],
         )
+        # Find proposals that match specific flags
+        relevant_pks = table.has_any(*options["b"], *denied_btns)
+        if verbose:
+            self.stdout.write(f"Found {len(relevant_pks)} proposals pre filtering")
+        # Find reactions over target
+        over_target_pks = table.over_target(republish_target_btn)
+        self.stdout.write(f"Found {len(over_target_pks)} proposals over target.")
+        relevant_pks -= over_target_pks
         if verbose:
             self.stdout.write(
-                f"Found {relevant_proposal_ids.count()} after removing proposals over target."
+                f"Found {len(relevant_pks)} after removing proposals over target."
             )
         if ignore_btns:
-            relevant_proposal_ids = relevant_proposal_ids.exclude(
-                object_id__in=Reaction.objects.filter(
-                    button__in=ignore_btns,
-                    object_id__in=prop_qs.values("pk"),
-                    content_type=ContentType.objects.get_for_model(Proposal),
-                ).values_list("object_id", flat=True)
-            )
+            relevant_pks -= table.has_any(*ignore_btns)
             if verbose:
                 self.stdout.write(
-                    f"Found {relevant_proposal_ids.count()} after removing items which have an ignore setting, "
+                    f"Found {len(relevant_pks)} after removing items which have an ignore setting, "
                     f"ie something that shouldn't be touched."
                 )
-        prop_qs = Proposal.objects.filter(
-            pk__in=relevant_proposal_ids, agenda_item__meeting=meeting
-        )
-        if unhandled_count := prop_qs.count():
-            self.stdout.write(
-                self.style.SUCCESS(
-                    f"Found {unhandled_count} proposals to set as unhandled."
-                )
-            )
-        else:
-            self.stdout.write(self.style.WARNING("Nothing set as unhandled."))
+        set_deny_pks = table.has_any(*denied_btns)
+        if options["chunk_size"]:
+            self.stdout.write(f"Found {len(relevant_pks)} proposals to adjust.")
+
+            def _run(chunk):
+                with set_actor(user):
+                    deny_count, unhandle_count = self.transition(
+                        list(prop_qs.filter(pk__in=chunk)), set_deny_pks, user
+                    )
+                return f"{deny_count} denied, {unhandle_count} unhandled"
+
+            run_chunks(self, relevant_pks, _run, options, title="proposals")
+            return
+        if not commit:
+            plan = Plan(command="mp_proposals_to_unhandled", meeting=meeting.pk)
+            for prop in prop_qs.filter(pk__in=relevant_pks):
+                plan.add(prop, "denied" if prop.pk in set_deny_pks else "unhandled")
+            return show_plan(self, plan, options)
         with transaction.atomic(durable=True):
             with set_actor(user):
-                if prop_qs.exists():
-                    pass
+                props = list(prop_qs.filter(pk__in=relevant_pks))
+                if props:
+                    self.stdout.write(
+                        self.style.SUCCESS(
+                            f"Found {len(props)} proposals to set as unhandled."
+                        )
+                    )
                 else:
                     self.stdout.write(self.style.WARNING("Nothing set as unhandled."))
                     exit()
-                deny_qs = prop_qs.filter(pk__in=set_deny_object_ids)
-                unhandle_qs = prop_qs.exclude(pk__in=set_deny_object_ids)
+                deny_count, unhandle_count = self.transition(props, set_deny_pks, user)
                 self.stdout.write(
                     self.style.SUCCESS(
-                        f"Setting {deny_qs.count()} as denided and {unhandle_qs.count()} as unhandled."
+                        f"Set {deny_count} as denided and {unhandle_count} as unhandled."
                     )
                 )
-                for prop in deny_qs:
-                    prop.denied()
-                    prop.save()
-                for prop in unhandle_qs:
-                    prop.unhandled()
-                    prop.save()
-            if commit:
-                self.stdout.write(self.style.SUCCESS("All done, saving"))
-            else:
-                self.stdout.write(
-                    self.style.WARNING("DRY-RUN: Specify --commit to save")
-                )
-                transaction.set_rollback(True)
+            self.stdout.write(self.style.SUCCESS("All done, saving"))
+
+    def transition(self, props, set_deny_pks: set[int], user) -> tuple[int, int]:
+        deny_props = [x for x in props if x.pk in set_deny_pks]
+        unhandle_props = [x for x in props if x.pk not in set_deny_pks]
+        bulk_transition(deny_props, "denied", actor=user)
+        bulk_transition(unhandle_props, "unhandled", actor=user)
+        return len(deny_props), len(unhandle_props)
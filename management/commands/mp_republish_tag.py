@@ -1,7 +1,4 @@
-from auditlog.context import set_actor
-from django.contrib.contenttypes.models import ContentType
 from django.core.management import BaseCommand
-from django.db import models
 from django.db import transaction
 
 from voteit.agenda.workflows import AgendaItemWf
@@ -10,6 +7,14 @@ from voteit.proposal.models import Proposal
 
 from voteit.proposal.workflows import ProposalWf
 from voteit.reactions.models import ReactionButton
+from voteit_tools.management.utils import add_chunk_arguments
+from voteit_tools.management.utils import add_plan_arguments
+from voteit_tools.management.utils import add_watch_arguments
+from voteit_tools.management.utils import run_chunks
+from voteit_tools.management.utils import run_plan
+from voteit_tools.management.utils import run_watch
+from voteit_tools.management.utils import show_plan
+from voteit_tools.republish import Republish
 
 
 class Command(BaseCommand):
@@ -35,6 +40,9 @@ class Command(BaseCommand):
         parser.add_argument(
             "--commit", help="Commit result to db", action="store_true", default=False
         )
+        add_watch_arguments(parser)
+        add_chunk_arguments(parser)
+        add_plan_arguments(parser)
 
     def handle(self, *args, **options):
         meeting: Meeting = Meeting.objects.get(pk=options.get("m"))
@@ -50,6 +58,8 @@ class Command(BaseCommand):
             assert flag_btn.flag_mode, "Flagga-knappen måste ha flag_mode satt"
             self.stdout.write(f"Will flag proposals that change state with {flag_btn}")
         user = meeting.participants.get(pk=options.get("u"))
+        if options["from_plan"]:
+            return run_plan(self, "mp_republish_tag", meeting, user, options)
 
         ai_qs = meeting.agenda_items.filter(tags__contains=[tag])
         if ai_count := ai_qs.count():
@@ -62,57 +72,46 @@ class Command(BaseCommand):
             agenda_item__in=ai_qs, state__in=self.PROP_STATES
         )
         # Find reactons over target
-        reactions_qs = (
-            republish_target_btn.reactions.filter(
-                object_id__in=prop_qs.values("pk"),
-                content_type=ContentType.objects.get_for_model(Proposal),
-            )
-            .values("object_id")
-            .annotate(count=models.Count("pk"))
-            .order_by()
-        )
         self.stdout.write(
             f"Target for {republish_target_btn} is {republish_target_btn.target}"
         )
-        reactions_qs = reactions_qs.filter(count__gte=republish_target_btn.target)
-        over_limit_prop_qs = prop_qs.filter(
-            pk__in=reactions_qs.values_list("object_id", flat=True)
-        )
+        republish = Republish(republish_target_btn, flag_btn, user)
+        watch = options["watch"]
+        if watch:
+            if not commit:
+                exit("--watch kräver --commit")
+            if options["chunk_size"]:
+                exit("--watch och --chunk-size går inte att kombinera")
+            watermark = republish.watermark()
+
+        if options["chunk_size"]:
+            props, table = republish.find(prop_qs)
+            self.stdout.write(f"Found {len(props)} proposals to adjust.")
+
+            def _run(chunk):
+                props, flagged = republish.run(prop_qs.filter(pk__in=chunk))
+                return f"published {len(props)}, flagged {len(flagged)}"
+
+            run_chunks(self, [x.pk for x in props], _run, options, title="proposals")
+            return
+        if not commit:
+            plan = republish.plan(prop_qs, "mp_republish_tag", meeting)
+            return show_plan(self, plan, options)
 
         with transaction.atomic(durable=True):
-            already_flagged_prop_pks = set()
-            if flag_btn:
-                already_flagged_prop_pks.update(
-                    flag_btn.reactions.filter(
-                        object_id__in=over_limit_prop_qs.values("pk"),
-                        content_type=ContentType.objects.get_for_model(Proposal),
-                    ).values_list("object_id", flat=True)
-                )
-            if prop_count := over_limit_prop_qs.count():
+            props, table = republish.find(prop_qs)
+            if props:
                 self.stdout.write(
-                    self.style.SUCCESS(f"Found {prop_count} proposals to adjust.")
+                    self.style.SUCCESS(f"Found {len(props)} proposals to adjust.")
                 )
             else:
                 self.stdout.write(self.style.WARNING(f"No proposals to adjust"))
-                exit()
-            flagged = 0
-            with set_actor(user):
-                for prop in over_limit_prop_qs:
-                    prop.publish()
-                    prop.save()
-                    if flag_btn and prop.pk not in already_flagged_prop_pks:
-                        flag_btn.reactions.create(
-                            object=prop, user=user, agenda_item_id=prop.agenda_item_id
-                        )
-                        flagged += 1
-                if flagged:
-                    self.stdout.write(
-                        f"Flagged {flagged} proposals after they changed state"
-                    )
-            if commit:
-                self.stdout.write(self.style.SUCCESS("All done, saving"))
-            else:
+                if not watch:
+                    exit()
+            if flagged := republish.apply(props, table):
                 self.stdout.write(
-                    self.style.WARNING("DRY-RUN: Specify --commit to save")
+                    f"Flagged {len(flagged)} proposals after they changed state"
                 )
-                transaction.set_rollback(True)
+            self.stdout.write(self.style.SUCCESS("All done, saving"))
+        if watch:
+            run_watch(self, republish, prop_qs, watermark, options)
@@ -0,0 +1,184 @@
+import csv
+import os
+
+from django.core.management import BaseCommand
+from django.utils import timezone
+
+from voteit.organisation.models import Organisation
+from voteit.poll.app.polls.combined_simple import CombinedSimple
+from voteit.poll.models import Poll
+from voteit.poll.workflows import PollWf
+from voteit.proposal.models import Proposal
+from voteit_tools.polls import Columns
+from voteit_tools.polls import ResultDataError
+from voteit_tools.polls import flatten_simple
+from voteit_tools.polls import iter_poll_proposals
+from voteit_tools.polls import register_totals
+from voteit_tools.utils import exectime
+
+# Column name and pyarrow type name
+EXPORT_COLUMNS = (
+    ("meeting", "int32"),
+    ("poll", "int32"),
+    ("proposal", "int32"),
+    ("yes", "int32"),
+    ("no", "int32"),
+    ("abstain", "int32"),
+    ("voters", "int32"),
+    ("weight", "int64"),
+)
+
+
+class Command(BaseCommand):
+    help = "Export combined simple poll results for all meetings in an organisation"
+
+    def add_arguments(self, parser):
+        parser.add_argument("organisation", help="first part of org domain name")
+        parser.add_argument(
+            "-y",
+            help="Year(s) the polls started, default this year",
+            type=int,
+            action="extend",
+            nargs="+",
+        )
+        parser.add_argument("-o", help="Output file", required=True)
+        parser.add_argument(
+            "--format",
+            help="csv (standard) or parquet, parquet requires pyarrow",
+            choices=["csv", "parquet"],
+            default="csv",
+        )
+        parser.add_argument(
+            "--batch",
+            help="Rows to collect before writing",
+            type=int,
+            default=10000,
+        )
+
+    def handle(self, *args, **options):
+        org = Organisation.objects.filter(
+            host__startswith=f"{options['organisation']}."
+        ).get()
+        years = options["y"] or [timezone.now().year]
+        poll_qs = Poll.objects.filter(
+            meeting__organisation=org,
+            state=PollWf.FINISHED,
+            method_name=CombinedSimple.name,
+            started__year__in=years,
+        )
+        if not poll_qs.exists():
+            exit(f"No finished polls in {org} for {', '.join(map(str, years))}")
+        # Voters and weight for all registers at once
+        totals = register_totals(poll_qs.values_list("electoral_register", flat=True))
+        columns = Columns([name for name, _ in EXPORT_COLUMNS])
+        fn = options["o"]
+        polls = rows = 0
+        with exectime() as et:
+            with self.open_writer(fn, options["format"]) as write:
+                for poll, proposal_pks in iter_poll_proposals(
+                    poll_qs,
+                    "meeting",
+                    "electoral_register",
+                    "method_name",
+                    "result_data",
+                ):
+                    # Flatteners only need the proposal pks
+                    proposals = [Proposal(pk=pk) for pk in proposal_pks]
+                    try:
+                        results = flatten_simple(poll, proposals)
+                    except ResultDataError as exc:
+                        exit(f"{exc}. Nothing written to {fn}")
+                    voters, weight = totals.get(poll.electoral_register_id, (0, 0))
+                    columns.extend(
+                        len(proposal_pks),
+                        meeting=poll.meeting_id,
+                        poll=poll.pk,
+                        proposal=proposal_pks,
+                        voters=voters,
+                        weight=weight,
+                        **results,
+                    )
+                    polls += 1
+                    if len(columns) >= options["batch"]:
+                        rows += len(columns)
+                        write(columns)
+                        columns.clear()
+                if len(columns):
+                    rows += len(columns)
+                    write(columns)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"All done, wrote {rows} rows from {polls} polls to {fn} in {et():.1f}s"
+            )
+        )
+
+    def open_writer(self, fn: str, fmt: str):
+        if fmt == "parquet":
+            return ParquetColumnsWriter(fn)
+        return CSVColumnsWriter(fn)
+
+
+def finish(tmp: str, fn: str, exc_type):
+    if exc_type is None:
+        os.replace(tmp, fn)
+    else:
+        os.remove(tmp)
+
+
+class CSVColumnsWriter:
+    """
+    Writes to a temporary file that replaces fn when done, or is removed on errors.
+    """
+
+    def __init__(self, fn: str):
+        self.fn = fn
+        self.tmp = f"{fn}.tmp"
+
+    def __enter__(self):
+        self.stream = open(self.tmp, "w")
+        self.writer = csv.writer(self.stream)
+        self.writer.writerow([name for name, _ in EXPORT_COLUMNS])
+        return self.write
+
+    def write(self, columns: Columns):
+        self.writer.writerows(columns.rows())
+
+    def __exit__(self, exc_type, *exc):
+        self.stream.close()
+        finish(self.tmp, self.fn, exc_type)
+
+
+class ParquetColumnsWriter:
+    """
+    Each batch becomes a row group with typed columns.
+    Written to a temporary file like CSVColumnsWriter.
+    """
+
+    def __init__(self, fn: str):
+        self.fn = fn
+        self.tmp = f"{fn}.tmp"
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            exit("Install pyarrow to write parquet files")
+        self.pa = pyarrow
+        self.schema = pyarrow.schema(
+            [
+                (name, getattr(pyarrow, type_name)())
+                for name, type_name in EXPORT_COLUMNS
+            ]
+        )
+        self.writer = pyarrow.parquet.ParquetWriter(self.tmp, self.schema)
+
+    def __enter__(self):
+        return self.write
+
+    def write(self, columns: Columns):
+        self.writer.write_table(
+            self.pa.Table.from_pydict(columns.columns, schema=self.schema)
+        )
+
+    def __exit__(self, exc_type, *exc):
+        self.writer.close()
+        finish(self.tmp, self.fn, exc_type)
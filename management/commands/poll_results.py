@@ -1,25 +1,33 @@
 import csv
-from dataclasses import asdict
+import os
 from dataclasses import dataclass
 from dataclasses import fields
 
 from django.core.management import BaseCommand
+from django.db import models
 
 from voteit.meeting.models import Meeting
 from voteit.poll.app.polls.combined_simple import CombinedSimple
 from voteit.poll.workflows import PollWf
 from voteit.poll.models import Poll
+from voteit.poll.utils import get_poll_method_registry
+from voteit_tools.polls import Columns
+from voteit_tools.polls import ExportedPolls
+from voteit_tools.polls import ResultDataError
+from voteit_tools.polls import get_flatteners
+from voteit_tools.polls import register_totals
 
 
 @dataclass
-class SimplePollProposalExport:
+class PollProposalExport:
     ai_title: str
     prop_text: str
-    yes: int
-    no: int
-    abstain: int
+    yes: int | None
+    no: int | None
+    abstain: int | None
     er_voters: int
     er_voter_weight: int
+    method: str
 
 
 class Command(BaseCommand):
@@ -27,46 +35,101 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument("-m", help="Meeting pk", required=True)
-        # reg = get_poll_method_registry()
-        # Vi kan lägga på fler metoder sen
-        # parser.add_argument("--method", choices=reg.keys(), default=CombinedSimple.name)
+        parser.add_argument(
+            "--method",
+            help="Poll methods to export, or all. Default is combined simple",
+            choices=[*get_poll_method_registry(), "all"],
+            action="extend",
+            nargs="+",
+        )
         parser.add_argument("-o", help="Output file", required=True)
+        parser.add_argument(
+            "--append",
+            help="Only add polls that aren't in the output file yet. "
+            "Exported poll pks are kept in <output>.exported",
+            action="store_true",
+        )
 
     def handle(self, *args, **options):
         meeting: Meeting = Meeting.objects.get(pk=options.get("m"))
+        flatteners = get_flatteners()
+        methods = options["method"] or [CombinedSimple.name]
+        if "all" in methods:
+            methods = list(get_poll_method_registry())
+        fn = options["o"]
+        settings = {"meeting": meeting.pk, "methods": sorted(methods)}
+        exported = None
+        if options["append"]:
+            exported = ExportedPolls(fn)
+            if exported and not exported.matches(**settings):
+                exit(f"{exported.fn} is for another meeting or other methods")
+            if exported and not os.path.exists(fn):
+                exit(f"{exported.fn} exists but not {fn}, remove it to start over")
         poll_qs = (
-            meeting.polls.filter(state=PollWf.FINISHED, method_name=CombinedSimple.name)
-            .prefetch_related(
-                "agenda_item",
-                "electoral_register",
-                "proposals",
-            )
-            .order_by("started")
+            meeting.polls.filter(state=PollWf.FINISHED, method_name__in=methods)
+            .select_related("agenda_item")
+            .order_by("started", "pk")
         )
-        if poll_qs.count():
+        if exported:
+            poll_qs = exported.filter(poll_qs)
+        if count := poll_qs.count():
             self.stdout.write(
-                f"Found {poll_qs.count()} polls with method {CombinedSimple.title} in meeting {meeting.title}"
+                f"Found {count} polls with method {', '.join(methods)} in meeting {meeting.title}"
             )
+        elif exported:
+            self.stdout.write(self.style.SUCCESS(f"No new polls, {fn} is up to date"))
+            return
         else:
-            exit("No finished polls with combined simple found, aborting")
-        items = []
-        for poll in poll_qs:
-            poll: Poll
-            for prop in poll.proposals.all():
-                items.append(
-                    SimplePollProposalExport(
-                        ai_title=poll.agenda_item.title,
-                        prop_text=prop.body,
-                        er_voters=poll.electoral_register.voterweight_set.count(),
-                        er_voter_weight=poll.electoral_register.get_total_vote_weight(),
-                        **poll.result_data["results"][str(prop.pk)],
-                    )
+            exit(f"No finished polls with {', '.join(methods)} found, aborting")
+        # Fail before writing anything if some polls can't be exported
+        if unsupported := list(
+            poll_qs.exclude(method_name__in=flatteners)
+            .values("method_name")
+            .annotate(count=models.Count("pk"))
+            .order_by("method_name")
+        ):
+            exit(
+                "No result flattener for: "
+                + ", ".join(
+                    f"{x['method_name']} ({x['count']} polls)" for x in unsupported
                 )
-        fn = options["o"]
-        with open(fn, "w") as stream:
-            writer = csv.DictWriter(
-                stream, fieldnames=[f.name for f in fields(SimplePollProposalExport)]
             )
-            writer.writeheader()  # Custom?
-            writer.writerows(iter(asdict(x) for x in items))
+        # Voters and weight for all registers at once
+        totals = register_totals(poll_qs.values_list("electoral_register", flat=True))
+        columns = Columns([f.name for f in fields(PollProposalExport)])
+        with open(fn, "a" if exported else "w") as stream:
+            writer = csv.writer(stream)
+            if not exported:
+                writer.writerow(columns.names)  # Custom?
+            # One poll at a time is flattened and written
+            for poll in poll_qs.prefetch_related("proposals").iterator(chunk_size=100):
+                poll: Poll
+                proposals = list(poll.proposals.all())
+                er_voters, er_voter_weight = totals.get(
+                    poll.electoral_register_id, (0, 0)
+                )
+                columns.extend(
+                    len(proposals),
+                    ai_title=poll.agenda_item.title,
+                    prop_text=[prop.body for prop in proposals],
+                    er_voters=er_voters,
+                    er_voter_weight=er_voter_weight,
+                    method=poll.method_name,
+                    **self.flatten(flatteners, poll, proposals, fn, exported, settings),
+                )
+                writer.writerows(columns.rows())
+                columns.clear()
+                if exported is not None:
+                    exported.add(poll)
+        if exported is not None:
+            exported.save(**settings)
         self.stdout.write(self.style.SUCCESS(f"All done, wrote {fn}"))
+
+    def flatten(self, flatteners, poll, proposals, fn, exported, settings) -> dict:
+        try:
+            return flatteners[poll.method_name](poll, proposals)
+        except ResultDataError as exc:
+            if exported is not None:
+                # Polls written so far shouldn't be appended again
+                exported.save(**settings)
+            exit(f"{exc}. {fn} is incomplete, fix the poll or export without it")
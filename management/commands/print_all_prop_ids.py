@@ -1,7 +1,11 @@
+import csv
+
 from django.core.management import BaseCommand
-from django.template.loader import render_to_string
 
 from voteit.meeting.models import Meeting
+from voteit.proposal.models import Proposal
+from voteit_tools.management.utils import open_output
+from voteit_tools.rendering import Renderer
 
 
 class Command(BaseCommand):
@@ -9,24 +13,55 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument("meeting", help="Meeting id", type=int)
+        parser.add_argument("-o", help="Skriv till fil istället för stdout")
+        parser.add_argument(
+            "--format",
+            help="html (standard), txt med en rad per förslag under varje rubrik, "
+            "eller csv med kolumnerna agenda_item, title, prop_id",
+            choices=["html", "txt", "csv"],
+            default="html",
+        )
 
     def handle(self, *args, **options):
         meeting: Meeting = Meeting.objects.get(id=options["meeting"])
-        ai_props = [
-            {
-                "title": ai.title,
-                "prop_ids": ai.proposals.order_by("created").values_list(
-                    "prop_id", flat=True
-                ),
-            }
-            for ai in meeting.agenda_items.all()
+        # All prop_ids in one query, grouped per agenda item in memory
+        ai_prop_ids = {}
+        for ai_pk, prop_id in (
+            Proposal.objects.filter(agenda_item__meeting=meeting)
+            .order_by("agenda_item_id", "created")
+            .values_list("agenda_item_id", "prop_id")
+            .iterator()
+        ):
+            ai_prop_ids.setdefault(ai_pk, []).append(prop_id)
+        ais = [
+            {"pk": pk, "title": title, "prop_ids": ai_prop_ids.get(pk, [])}
+            for pk, title in meeting.agenda_items.values_list("pk", "title")
         ]
-        self.stdout.write(
-            render_to_string(
-                "all_props.html",
-                {
-                    "meeting": meeting,
-                    "ai_props": ai_props,
-                },
-            )
+        with open_output(self, options["o"]) as out:
+            if options["format"] == "csv":
+                writer = csv.writer(out)
+                writer.writerow(["agenda_item", "title", "prop_id"])
+                for ai in ais:
+                    writer.writerows(
+                        [ai["pk"], ai["title"], prop_id] for prop_id in ai["prop_ids"]
+                    )
+            elif options["format"] == "txt":
+                out.write(f"{meeting.title}\n")
+                for ai in ais:
+                    out.write(f"\n{ai['title']}\n")
+                    if not ai["prop_ids"]:
+                        out.write("Inga förslag\n")
+                    for prop_id in ai["prop_ids"]:
+                        out.write(f"#{prop_id}\n")
+            else:
+                self.write_html(out, meeting, ais)
+
+    def write_html(self, out, meeting, ais):
+        renderer = Renderer()
+        header, footer = renderer.split(
+            "all_props.html", {"meeting": meeting}, "rendered_ais"
         )
+        out.write(header)
+        for ai in ais:
+            out.write(renderer.render("all_props_ai.html", {"ai": ai}))
+        out.write(footer)
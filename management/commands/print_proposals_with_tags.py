@@ -1,12 +1,15 @@
 from itertools import groupby
 
 from django.core.management import BaseCommand
-from django.template.loader import render_to_string
 
 from voteit.meeting.models import Meeting
 from voteit.proposal.models import Proposal
-from voteit.proposal.models import TextParagraph
-from voteit.proposal.rest_api.serializers import GenericProposalSerializer
+from voteit_tools.management.utils import add_check_rows_argument
+from voteit_tools.management.utils import check_rows
+from voteit_tools.management.utils import open_output
+from voteit_tools.proposals import proposal_context
+from voteit_tools.proposals import proposal_context_maps
+from voteit_tools.rendering import Renderer
 
 
 class Command(BaseCommand):
@@ -22,68 +25,48 @@ class Command(BaseCommand):
             action="extend",
             nargs="+",
         )
+        parser.add_argument("-o", help="Write to file instead of stdout")
+        add_check_rows_argument(parser)
 
     def handle(self, *args, **options):
         meeting: Meeting = Meeting.objects.get(pk=options.get("m"))
         tags = options.get("t")
+        matched_qs = Proposal.objects.filter(
+            tags__contains=tags, agenda_item__meeting=meeting
+        )
         prop_qs = (
-            Proposal.objects.filter(tags__contains=tags, agenda_item__meeting=meeting)
-            .select_subclasses()
+            matched_qs.select_subclasses()
             .order_by("agenda_item__order")
             .select_related("agenda_item")
         )
-        # Other things needed
-        meeting_groups_map = {x.pk: x for x in meeting.groups.all()}
-        users_map = {
-            x.pk: x
-            for x in meeting.participants.filter(
-                pk__in=prop_qs.values_list("author", flat=True)
-            )
-        }
-        paragraph_tag_map = {
-            x.pk: x.tag
-            for x in TextParagraph.objects.filter(agenda_item__meeting=meeting)
-        }
-        rendered_ais = []
-        for agenda_item, proposals in groupby(
-            prop_qs, lambda proposal: proposal.agenda_item
-        ):
-            rendered_proposals = []
-            for prop in proposals:
-                serializer = GenericProposalSerializer(prop)
-                data = {**serializer.data}
-                # Meeting Group
-                try:
-                    data["meeting_group"] = meeting_groups_map[data["meeting_group"]]
-                except KeyError:
-                    data["meeting_group"] = None
-                # Author
-                try:
-                    data["author"] = users_map[data["author"]]
-                except KeyError:
-                    data["author"] = {
-                        "userid": "",
-                        "get_full_name": "(Removed user)",
-                    }
-                try:
-                    data["ptag"] = paragraph_tag_map[data["paragraph"]]
-                except KeyError:
-                    pass
-                # Adjust tags and remove prop id
-                if prop.prop_id in data["tags"]:
-                    data["tags"].remove(prop.prop_id)
-                rendered_proposals.append(
-                    render_to_string("voteit/proposal.html", {"proposal": data})
-                )
-            rendered_ais.append(
-                render_to_string(
-                    "voteit/ai.html",
-                    {"agenda_item": agenda_item, "proposals": rendered_proposals},
-                )
-            )
-        self.stdout.write(
-            render_to_string(
-                "voteit/meeting.html",
-                {"rendered_ais": rendered_ais, "title": meeting.title},
-            )
+        if options["check_rows"]:
+            return check_rows(self, prop_qs)
+        # Only groups, users and paragraphs the matched proposals refer to
+        meeting_groups_map, users_map, paragraph_tag_map = proposal_context_maps(
+            meeting, matched_qs
         )
+        renderer = Renderer()
+        header, footer = renderer.split(
+            "voteit/meeting.html", {"title": meeting.title}, "rendered_ais"
+        )
+        with open_output(self, options["o"]) as out:
+            out.write(header)
+            # One agenda item at a time is rendered and written
+            for agenda_item, proposals in groupby(
+                prop_qs.iterator(), lambda proposal: proposal.agenda_item
+            ):
+                rendered_proposals = []
+                for prop in proposals:
+                    data = proposal_context(
+                        prop, meeting_groups_map, users_map, paragraph_tag_map
+                    )
+                    rendered_proposals.append(
+                        renderer.render("voteit/proposal.html", {"proposal": data})
+                    )
+                out.write(
+                    renderer.render(
+                        "voteit/ai.html",
+                        {"agenda_item": agenda_item, "proposals": rendered_proposals},
+                    )
+                )
+            out.write(footer)
@@ -1,14 +1,133 @@
+from contextlib import ExitStack
+from contextlib import contextmanager
 from contextlib import suppress
+from statistics import median
+from statistics import stdev
+from time import perf_counter
+from unittest.mock import patch
 
 from django.contrib.auth import get_user_model
+from django.core.cache import caches
 from django.core.management import BaseCommand
 from django.db.transaction import get_connection
 from django.test.utils import CaptureQueriesContext
 from django.urls import NoReverseMatch
+from django.urls import get_resolver
 from django.urls import reverse
+from rest_framework.renderers import BaseRenderer
+from rest_framework.serializers import ListSerializer
+from rest_framework.serializers import Serializer
 from rest_framework.test import APIClient
+from rest_framework.test import APIRequestFactory
+from rest_framework.test import force_authenticate
 
-from voteit_tools.utils import exectime
+from voteit_tools.management.utils import add_bench_arguments
+from voteit_tools.management.utils import add_tracer_arguments
+from voteit_tools.management.utils import get_bench_run
+from voteit_tools.management.utils import get_tracer
+from voteit_tools.management.utils import save_bench_run
+
+
+class Breakdown:
+    """
+    Attribute request time to database, serializers and rendering.
+    Database time spent while serializing (lazy querysets, method fields)
+    is only counted as database time.
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.total = 0.0
+        self.db = 0.0
+        self.serializer = 0.0
+        self.render = 0.0
+        self.items = 0
+        self.size = 0
+        self._depth = 0
+
+    @contextmanager
+    def capture(self):
+        with ExitStack() as stack:
+            stack.enter_context(get_connection().execute_wrapper(self._db_wrapper))
+            for cls in (Serializer, ListSerializer):
+                stack.enter_context(
+                    patch.object(
+                        cls,
+                        "to_representation",
+                        self._wrap(cls.to_representation, "serializer"),
+                    )
+                )
+            for cls in self._renderer_classes():
+                stack.enter_context(
+                    patch.object(cls, "render", self._wrap(cls.render, "render"))
+                )
+            start = perf_counter()
+            yield self
+            self.total += perf_counter() - start
+            self.requests += 1
+
+    @staticmethod
+    def _renderer_classes():
+        """
+        Every renderer class with its own render method, including the ones views set
+        with renderer_classes. Loading the urlconf imports the views that define them.
+        """
+        get_resolver().url_patterns
+        found, todo = set(), [BaseRenderer]
+        while todo:
+            cls = todo.pop()
+            if cls not in found:
+                found.add(cls)
+                todo.extend(cls.__subclasses__())
+        return [x for x in found if "render" in x.__dict__]
+
+    def _db_wrapper(self, execute, sql, params, many, context):
+        start = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db += perf_counter() - start
+
+    def _wrap(self, func, attr):
+        breakdown = self
+
+        def wrapper(instance, *args, **kwargs):
+            # Nested serializers are part of the outermost one
+            if breakdown._depth:
+                return func(instance, *args, **kwargs)
+            breakdown._depth += 1
+            start, db = perf_counter(), breakdown.db
+            try:
+                return func(instance, *args, **kwargs)
+            finally:
+                breakdown._depth -= 1
+                elapsed = perf_counter() - start - (breakdown.db - db)
+                setattr(breakdown, attr, getattr(breakdown, attr) + elapsed)
+
+        return wrapper
+
+    def add_response(self, response):
+        data = response.json()
+        if isinstance(data, dict) and isinstance(data.get("results"), list):
+            data = data["results"]
+        self.items += len(data) if isinstance(data, list) else 1
+        self.size += len(response.content)
+
+    def report(self) -> str:
+        def _part(title, value):
+            share = value / self.total if self.total else 0
+            return f"{title}: {value / self.requests:.4f} ({share:.0%})"
+
+        other = self.total - self.db - self.serializer - self.render
+        return " - ".join(
+            [
+                _part("DB", self.db),
+                _part("Serializer", self.serializer),
+                _part("Render", self.render),
+                _part("Other", other),
+                f"Bytes/item: {self.size / self.items if self.items else 0:,.0f}",
+            ]
+        )
 
 
 class Command(BaseCommand):
@@ -17,7 +136,7 @@ class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument(
             "url_or_reverse",
-            help="URL or reverse lookup name. Type 'all' for all of list urls.",
+            help="URL or reverse lookup name. Type 'all' for all list and detail urls.",
         )
         parser.add_argument(
             "-u",
@@ -30,6 +149,38 @@ class Command(BaseCommand):
             action="store_true",
             default=False,
         )
+        parser.add_argument(
+            "--sample",
+            help="In 'all' mode, also check detail urls for this many random objects per viewset",
+            type=int,
+            default=3,
+        )
+        parser.add_argument(
+            "--repeat",
+            help="Measure each url this many times after the first (cold) request",
+            type=int,
+            default=0,
+        )
+        parser.add_argument(
+            "--warmup",
+            help="Unmeasured requests between the cold and the repeated ones",
+            type=int,
+            default=0,
+        )
+        parser.add_argument(
+            "--clear-cache",
+            help="Clear Django's caches before each measured request",
+            action="store_true",
+            default=False,
+        )
+        parser.add_argument(
+            "--breakdown",
+            help="Split time per request into DB, serializer, renderer and other",
+            action="store_true",
+            default=False,
+        )
+        add_tracer_arguments(parser)
+        add_bench_arguments(parser)
 
     def get_all_list_urls(self):
         from voteit.core.rest_api.router import router
@@ -38,36 +189,195 @@ class Command(BaseCommand):
             with suppress(NoReverseMatch):
                 yield reverse(basename + "-list")
 
-    def check_url(self, user, client, url, sql=False):
+    def get_all_detail_urls(self, user, sample: int):
+        """
+        Sample objects from each viewsets queryset, as the user would see it when listing.
+        """
+        from voteit.core.rest_api.router import router
+
+        factory = APIRequestFactory()
+        for prefix, viewset, basename in router.registry:
+            try:
+                request = factory.get(reverse(basename + "-list"))
+            except NoReverseMatch:
+                continue
+            force_authenticate(request, user)
+            view = viewset(action_map={"get": "list"}, action="list")
+            view.args, view.kwargs, view.format_kwarg = (), {}, None
+            view.request = view.initialize_request(request)
+            lookup_field = viewset.lookup_field
+            lookup_url_kwarg = viewset.lookup_url_kwarg or lookup_field
+            try:
+                values = list(
+                    view.filter_queryset(view.get_queryset())
+                    .order_by("?")
+                    .values_list(lookup_field, flat=True)[:sample]
+                )
+            except Exception as exc:
+                self.stdout.write(
+                    self.style.WARNING(f"Can't sample objects for {basename}: {exc}")
+                )
+                continue
+            with suppress(NoReverseMatch):
+                yield basename, [
+                    reverse(basename + "-detail", kwargs={lookup_url_kwarg: x})
+                    for x in values
+                ]
+
+    def get(self, client, url, tracer, name, clear_cache=False, breakdown=None):
+        if clear_cache:
+            for cache in caches.all():
+                cache.clear()
         conn = get_connection()
-        with CaptureQueriesContext(connection=conn) as cqc:
-            with exectime() as et:
+        with ExitStack() as stack:
+            cqc = stack.enter_context(CaptureQueriesContext(connection=conn))
+            if breakdown:
+                stack.enter_context(breakdown.capture())
+            with tracer.span(name) as span:
                 response = client.get(url)
+        if breakdown and response.content:
+            breakdown.add_response(response)
+        return response, span, cqc
+
+    def check_url(
+        self,
+        user,
+        client,
+        url,
+        tracer,
+        run,
+        sql=False,
+        repeat=0,
+        warmup=0,
+        clear_cache=False,
+        breakdown=False,
+        case=None,
+    ):
+        case = case or url
+        breakdown = breakdown and Breakdown()
+        with tracer.span(url) as url_span:
+            response, span, cqc = self.get(
+                client,
+                url,
+                tracer,
+                "cold",
+                clear_cache=clear_cache,
+                breakdown=breakdown,
+            )
             if not response.content:
                 self.stdout.write(self.style.ERROR(f"URL: {url} wasn't proper json"))
-                return
-            msg = (
-                f"URL: {url} execution time: {et():.4f} secs - Queries: {len(cqc)} - "
-                f"Content items: {len(response.json())} - Length: {len(response.content)}"
+                return []
+            for i in range(warmup):
+                client.get(url)
+            warm = []
+            for i in range(repeat):
+                warm.append(
+                    self.get(
+                        client,
+                        url,
+                        tracer,
+                        f"warm {i + 1}",
+                        clear_cache=clear_cache,
+                        breakdown=breakdown,
+                    )
+                )
+        msg = (
+            f"URL: {url} execution time: {span.duration:.4f} secs - Queries: {len(cqc)} - "
+            f"Content items: {len(response.json())} - Length: {len(response.content)}"
+        )
+        run.add(
+            f"{case} (cold)" if repeat else case,
+            span.duration,
+            queries=len(cqc),
+            size=len(response.content),
+        )
+        if len(cqc) > 5:
+            msg = self.style.ERROR(msg)
+        elif len(cqc) > 2:
+            msg = self.style.WARNING(msg)
+        self.stdout.write(msg)
+        if warm:
+            timings = [x[1].duration for x in warm]
+            for warm_response, warm_span, warm_cqc in warm:
+                run.add(
+                    case,
+                    warm_span.duration,
+                    queries=len(warm_cqc),
+                    size=len(warm_response.content),
+                )
+            self.stdout.write(
+                f"    Warm x{len(timings)}: min {min(timings):.4f} - "
+                f"median {median(timings):.4f} - "
+                f"stdev {stdev(timings) if len(timings) > 1 else 0:.4f} secs - "
+                f"Queries: {len(warm[-1][2])}"
             )
-            if len(cqc) > 5:
-                msg = self.style.ERROR(msg)
-            elif len(cqc) > 2:
-                msg = self.style.WARNING(msg)
-            self.stdout.write(msg)
-            if sql:
-                self.stdout.write(str(cqc.captured_queries))
+        if breakdown:
+            self.stdout.write(f"    {breakdown.report()}")
+        if url_span.memory is not None:
+            self.stdout.write(
+                f"Memory: {url_span.memory:,} (peak {url_span.memory_peak:,})"
+            )
+        if url_span.profile:
+            self.stdout.write(url_span.profile)
+        if sql:
+            self.stdout.write(str(cqc.captured_queries))
+        return [(span, len(cqc))] + [(x[1], len(x[2])) for x in warm]
+
+    def check_detail(self, basename, urls, *args, **kwargs):
+        measured = []
+        for url in urls:
+            measured.extend(
+                self.check_url(*args, url=url, case=f"{basename}-detail", **kwargs)
+            )
+        if not measured:
+            return
+        timings = [x[0].duration for x in measured]
+        queries = [x[1] for x in measured]
+        msg = (
+            f"Detail {basename}: {len(urls)} objects - min {min(timings):.4f} - "
+            f"median {median(timings):.4f} - max {max(timings):.4f} secs - "
+            f"Queries: {min(queries)}-{max(queries)}"
+        )
+        if max(queries) > 5:
+            msg = self.style.ERROR(msg)
+        elif max(queries) > 2:
+            msg = self.style.WARNING(msg)
+        self.stdout.write(msg)
 
     def handle(self, *args, **options):
         User = get_user_model()
         user = User.objects.get(pk=options["u"])
         client = APIClient()
         client.force_login(user)
+        tracer = get_tracer(options)
+        run = get_bench_run("rest_bench", options)
+        check_kwargs = dict(
+            sql=options["sql"],
+            repeat=options["repeat"],
+            warmup=options["warmup"],
+            clear_cache=options["clear_cache"],
+            breakdown=options["breakdown"],
+        )
         url = options["url_or_reverse"]
         if url == "all":
             for url in self.get_all_list_urls():
-                self.check_url(user, client, url, sql=options["sql"])
+                self.check_url(user, client, url, tracer, run, **check_kwargs)
+            if options["sample"]:
+                for basename, urls in self.get_all_detail_urls(user, options["sample"]):
+                    self.check_detail(
+                        basename,
+                        urls,
+                        user=user,
+                        client=client,
+                        tracer=tracer,
+                        run=run,
+                        **check_kwargs,
+                    )
         else:
             if not url.startswith("/"):
                 url = reverse(url)
-            self.check_url(user, client, url, sql=options["sql"])
+            self.check_url(user, client, url, tracer, run, **check_kwargs)
+        if fn := options["trace"]:
+            tracer.write_chrome_trace(fn)
+            self.stdout.write(self.style.SUCCESS(f"Wrote trace to {fn}"))
+        save_bench_run(self, run, options)
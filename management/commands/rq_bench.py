@@ -11,6 +11,10 @@ from envelope.channels.messages import Subscribe
 from envelope.channels.models import ContextChannel
 from envelope.utils import get_context_channel_registry
 from voteit.meeting.models import Meeting
+from voteit_tools.management.utils import add_bench_arguments
+from voteit_tools.management.utils import get_bench_run
+from voteit_tools.management.utils import save_bench_run
+from voteit_tools.utils import exectime
 
 if TYPE_CHECKING:
     pass
@@ -42,6 +46,7 @@ class Command(BaseCommand):
             "pk",
             help="channel object pk",
         )
+        add_bench_arguments(parser)
 
     def handle(self, *args, **options):
         channel_type: type[ContextChannel] = self.channel_reg[options["name"]]
@@ -52,6 +57,7 @@ class Command(BaseCommand):
             f"Running subscribe on channel {channel_type} with {meeting.participants.count()} subscribers"
         )
         queue = get_queue("default")
+        run = get_bench_run("rq_bench", options)
         user_pks = list(meeting.participants.all().values_list("pk", flat=True))
         for user_pk in user_pks:
             msg = Subscribe(
@@ -60,7 +66,10 @@ class Command(BaseCommand):
                 channel_type=options["name"],
             )
             msg.rq_queue = queue
-            msg.enqueue()
+            with exectime() as et:
+                msg.enqueue()
+            run.add("enqueue", et())
+        save_bench_run(self, run, options)
         self.stdout.write("Cleaning up. Check rq monitor for stats.")
         for user_pk in user_pks:
             ch = channel_type.from_instance(
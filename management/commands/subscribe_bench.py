@@ -19,7 +19,11 @@ from envelope.channels.models import ContextChannel
 from envelope.signals import channel_subscribed
 from envelope.utils import get_context_channel_registry
 
-from voteit_tools.utils import exectime
+from voteit_tools.management.utils import add_bench_arguments
+from voteit_tools.management.utils import add_tracer_arguments
+from voteit_tools.management.utils import get_bench_run
+from voteit_tools.management.utils import get_tracer
+from voteit_tools.management.utils import save_bench_run
 
 if TYPE_CHECKING:
     pass
@@ -62,6 +66,8 @@ class Command(BaseCommand):
             action="store_true",
             default=False,
         )
+        add_tracer_arguments(parser)
+        add_bench_arguments(parser)
 
     def handle(self, *args, **options):
         User = get_user_model()
@@ -72,22 +78,32 @@ class Command(BaseCommand):
         msg = _mk_message(instance.pk, channel.name, user.pk)
         conn = get_connection()
         channel_layer = get_channel_layer()
+        tracer = get_tracer(options)
+        run = get_bench_run("subscribe_bench", options)
 
         with CaptureQueriesContext(connection=conn) as cqc:
             with patch.object(channel_layer, "send") as mocked_send:
-                msg.run_job()
+                with tracer.span(f"subscribe {channel.name} {instance.pk}") as span:
+                    msg.run_job()
             self.stdout.write(f"Queries on subscribe: {len(cqc)}")
+            run.add(
+                "subscribe",
+                span.duration,
+                queries=len(cqc),
+                size=sum(len(mc.args[1]["text_data"]) for mc in mocked_send.mock_calls),
+            )
             for mc in mocked_send.mock_calls:
                 txt = mc.args[1]["text_data"]
                 self.stdout.write("Payload size: %s" % "{:,}".format(len(txt)))
                 clvl = 3
-                with exectime() as et:
+                with tracer.span(f"compress lvl {clvl}") as span:
                     txt_compressed = zlib.compress(bytes(txt, "utf-8"), level=clvl)
+                run.add(f"compress lvl {clvl}", span.duration, size=len(txt_compressed))
                 self.stdout.write(
-                    f"Payload compressed lvl {clvl} size: %s - exec time {et():.4f}"
+                    f"Payload compressed lvl {clvl} size: %s - exec time {span.duration:.4f}"
                     % "{:,}".format(len(txt_compressed))
                 )
-                self.stdout.write(f"Compress exec time: {et():.4f} secs")
+                self.stdout.write(f"Compress exec time: {span.duration:.4f} secs")
                 data = loads(txt)
                 app_state = data["p"]["app_state"]
                 if not app_state:
@@ -119,15 +135,23 @@ class Command(BaseCommand):
             app_state=app_state,
         )
         receivers, areceivers = channel_subscribed._live_receivers(channel)
-        for receiver in receivers:
-            with CaptureQueriesContext(connection=conn) as cqc:
-                with exectime() as et:
-                    receiver(signal=channel_subscribed, **kwargs)
-                self.stdout.write(
-                    f"Receiver: {receiver.__module__}.{receiver.__name__} execution time: {et():.4f} secs - queries: {len(cqc)}"
-                )
-                if options["sql"]:
-                    self.stdout.write(str(cqc.captured_queries))
-                print("-" * 80)
+        with tracer.span("channel_subscribed receivers"):
+            for receiver in receivers:
+                name = f"{receiver.__module__}.{receiver.__name__}"
+                with CaptureQueriesContext(connection=conn) as cqc:
+                    with tracer.span(name) as span:
+                        receiver(signal=channel_subscribed, **kwargs)
+                    run.add(name, span.duration, queries=len(cqc))
+                    self.stdout.write(
+                        f"Receiver: {name} execution time: {span.duration:.4f} secs - queries: {len(cqc)}"
+                    )
+                    if options["sql"]:
+                        self.stdout.write(str(cqc.captured_queries))
+                    print("-" * 80)
         if areceivers:
             print(f"There were {len(areceivers)} async receivers")
+        self.stdout.write(tracer.report())
+        if fn := options["trace"]:
+            tracer.write_chrome_trace(fn)
+            self.stdout.write(self.style.SUCCESS(f"Wrote trace to {fn}"))
+        save_bench_run(self, run, options)
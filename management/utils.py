@@ -1,3 +1,11 @@
+from __future__ import annotations
+
+from contextlib import contextmanager
+from contextlib import suppress
+
+from django.utils import timezone
+
+
 def get_user(value: str, meeting):
     try:
         return meeting.participants.get(**{"pk": int(value)})
@@ -10,3 +18,225 @@ def get_group(value: str, meeting):
         return meeting.groups.get(**{"pk": int(value)})
     except ValueError:
         return meeting.groups.get(**{"groupid": value})
+
+
+def add_tracer_arguments(parser):
+    parser.add_argument(
+        "--memory",
+        help="Track allocated memory per span with tracemalloc (slow)",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--profile",
+        help="Profile with cProfile and print this many hot functions",
+        type=int,
+        default=0,
+    )
+    parser.add_argument(
+        "--trace",
+        help="Write spans as Chrome trace-event JSON to this file",
+    )
+
+
+def get_tracer(options):
+    from voteit_tools.utils import Tracer
+
+    return Tracer(memory=options["memory"], profile=options["profile"])
+
+
+def add_bench_arguments(parser):
+    parser.add_argument(
+        "--save",
+        help="Append results to this JSON-lines file, compare runs with bench_compare",
+    )
+    parser.add_argument("--label", help="Label for saved run", default="")
+
+
+def get_bench_run(command: str, options):
+    from voteit_tools.bench import BenchRun
+
+    args = {
+        k: v
+        for k, v in options.items()
+        if k not in ("save", "label", "stdout", "stderr", "skip_checks")
+    }
+    return BenchRun(command=command, label=options["label"], args=args)
+
+
+def save_bench_run(cmd, run, options):
+    if fn := options["save"]:
+        run.save(fn)
+        cmd.stdout.write(cmd.style.SUCCESS(f"Saved run {run.id} to {fn}"))
+
+
+def add_watch_arguments(parser):
+    parser.add_argument(
+        "--watch",
+        help="Keep running and check proposals with new reactions, requires --commit",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--interval",
+        help="Seconds between checks in watch mode",
+        type=float,
+        default=10,
+    )
+    parser.add_argument(
+        "--batch",
+        help="Proposals per committed transaction in watch mode",
+        type=int,
+        default=50,
+    )
+
+
+def run_watch(cmd, republish, prop_qs, watermark, options):
+    cmd.stdout.write(
+        f"Watching for new reactions every {options['interval']} secs, Ctrl+C to stop"
+    )
+    with suppress(KeyboardInterrupt):
+        for props, flagged in republish.watch(
+            prop_qs,
+            watermark,
+            options["interval"],
+            options["batch"],
+            on_error=lambda exc: cmd.stderr.write(
+                cmd.style.ERROR(
+                    f"{timezone.localtime():%H:%M:%S} Database error, retrying: {exc}"
+                )
+            ),
+        ):
+            cmd.stdout.write(
+                cmd.style.SUCCESS(
+                    f"{timezone.localtime():%H:%M:%S} Published {len(props)} proposals, "
+                    f"flagged {len(flagged)}: " + ", ".join(x.prop_id for x in props)
+                )
+            )
+
+
+def add_chunk_arguments(parser):
+    parser.add_argument(
+        "--chunk-size",
+        help="Commit in transactions of this many objects instead of one for everything",
+        type=int,
+    )
+    parser.add_argument(
+        "--progress",
+        help="With --chunk-size: file to keep committed pks in, rerun with it to resume",
+    )
+
+
+def run_chunks(cmd, pks, func, options, title="objects"):
+    from voteit_tools.chunks import ChunkProgress
+    from voteit_tools.chunks import process_in_chunks
+
+    commit = options["commit"]
+    progress = ChunkProgress(options["progress"])
+    if progress.done:
+        cmd.stdout.write(f"Resuming, {len(progress.done)} {title} already done")
+    for chunk, result in process_in_chunks(
+        pks, options["chunk_size"], func, commit, progress
+    ):
+        msg = f"{len(chunk)} {title} ({chunk[0]}-{chunk[-1]})"
+        if result:
+            msg += f": {result}"
+        if commit:
+            cmd.stdout.write(cmd.style.SUCCESS(f"Committed {msg}"))
+        else:
+            cmd.stdout.write(cmd.style.WARNING(f"DRY-RUN: Rolled back {msg}"))
+    if not commit:
+        cmd.stdout.write(cmd.style.WARNING("DRY-RUN: Specify --commit to save"))
+
+
+def add_plan_arguments(parser):
+    parser.add_argument(
+        "--plan",
+        help="Without --commit: save planned changes as JSON to this file",
+    )
+    parser.add_argument(
+        "--from-plan",
+        help="Execute a plan saved with --plan, requires --commit to write",
+    )
+
+
+def show_plan(cmd, plan, options):
+    for change in plan.changes:
+        cmd.stdout.write(str(change))
+    cmd.stdout.write(
+        cmd.style.WARNING(
+            f"DRY-RUN: {len(plan.changes)} planned changes, nothing written. "
+            f"Specify --commit to save"
+        )
+    )
+    if fn := options["plan"]:
+        plan.save(fn)
+        cmd.stdout.write(f"Saved plan to {fn}, run with --from-plan {fn} --commit")
+
+
+def run_plan(cmd, command: str, meeting, user, options):
+    from django.db import transaction
+
+    from voteit_tools.plan import Plan
+
+    fn = options["from_plan"]
+    plan = Plan.load(fn)
+    if plan.command != command:
+        exit(f"Plan {fn} was made by {plan.command}, not {command}")
+    if plan.meeting != meeting.pk:
+        exit(f"Plan {fn} is for meeting {plan.meeting}")
+    if not options["commit"]:
+        props, stale = plan.check(meeting)
+        for change in plan.changes:
+            msg = str(change)
+            cmd.stdout.write(
+                cmd.style.ERROR(f"{msg} (stale)") if change.pk not in props else msg
+            )
+        cmd.stdout.write(
+            cmd.style.WARNING(
+                f"DRY-RUN: {len(props)} valid and {len(stale)} stale changes. "
+                f"Specify --commit to save"
+            )
+        )
+        return
+    with transaction.atomic(durable=True):
+        count, flagged, stale = plan.execute(user, meeting)
+    for change in stale:
+        cmd.stdout.write(cmd.style.WARNING(f"Skipped stale {change}"))
+    cmd.stdout.write(
+        cmd.style.SUCCESS(f"All done, changed {count} and flagged {flagged} proposals")
+    )
+
+
+def add_check_rows_argument(parser):
+    parser.add_argument(
+        "--check-rows",
+        help="Compare proposal data with GenericProposalSerializer and exit",
+        action="store_true",
+    )
+
+
+def check_rows(cmd, props):
+    from voteit_tools.proposals import check_row_parity
+
+    if errors := check_row_parity(props):
+        for error in errors:
+            cmd.stderr.write(error)
+        exit(f"{len(errors)} differences")
+    cmd.stdout.write(cmd.style.SUCCESS("All proposals match the serializer"))
+
+
+@contextmanager
+def open_output(cmd, fn: str | None = None):
+    """
+    Chunked writer for a file, or the commands stdout if no filename is given.
+    """
+    from voteit_tools.rendering import ChunkedWriter
+
+    if fn:
+        with open(fn, "w") as stream:
+            with ChunkedWriter(stream.write) as writer:
+                yield writer
+    else:
+        with ChunkedWriter(lambda txt: cmd.stdout.write(txt, ending="")) as writer:
+            yield writer
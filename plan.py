@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+import json
+from collections import defaultdict
+from dataclasses import asdict
+from dataclasses import dataclass
+from dataclasses import field
+from datetime import datetime
+
+from auditlog.context import set_actor
+
+from voteit.proposal.models import Proposal
+from voteit.reactions.models import Reaction
+from voteit.reactions.models import ReactionButton
+from voteit_tools.bulk import bulk_create
+from voteit_tools.bulk import bulk_transition
+from voteit_tools.bulk import transition_target
+from voteit_tools.thresholds import ReactionTable
+from voteit_tools.thresholds import mk_flag_reactions
+
+
+@dataclass
+class PlannedChange:
+    pk: int
+    prop_id: str
+    transition: str
+    from_state: str
+    to_state: str | None
+    # Flag button to react with after the transition
+    flag: int | None = None
+
+    def __str__(self):
+        txt = f"#{self.prop_id} ({self.pk}): {self.from_state} -> {self.to_state}"
+        if self.flag:
+            txt += f" + flag {self.flag}"
+        return txt
+
+
+@dataclass
+class Plan:
+    """
+    Changes a command intends to make, computed from reads only.
+    Can be saved as JSON and executed later.
+    """
+
+    command: str
+    meeting: int
+    changes: list[PlannedChange] = field(default_factory=list)
+    created: str = field(default_factory=lambda: datetime.now().isoformat())
+
+    def add(self, prop: Proposal, transition: str, flag: ReactionButton | None = None):
+        self.changes.append(
+            PlannedChange(
+                pk=prop.pk,
+                prop_id=prop.prop_id,
+                transition=transition,
+                from_state=prop.state,
+                to_state=transition_target(prop, transition),
+                flag=flag.pk if flag else None,
+            )
+        )
+
+    def save(self, fn: str):
+        with open(fn, "w") as stream:
+            json.dump(asdict(self), stream, indent=2)
+
+    @classmethod
+    def load(cls, fn: str) -> Plan:
+        with open(fn) as stream:
+            data = json.load(stream)
+        data["changes"] = [PlannedChange(**x) for x in data["changes"]]
+        return cls(**data)
+
+    def check(self, meeting) -> tuple[dict[int, Proposal], list[PlannedChange]]:
+        """
+        Proposals in meeting that are still in the planned from state, and stale changes.
+        Changes for other meetings or with a flag button from another meeting are stale.
+        """
+        props = Proposal.objects.filter(agenda_item__meeting=meeting).in_bulk(
+            [x.pk for x in self.changes]
+        )
+        buttons = set(meeting.reaction_buttons.values_list("pk", flat=True))
+        valid, stale = {}, []
+        for change in self.changes:
+            prop = props.get(change.pk)
+            if (
+                prop is None
+                or prop.state != change.from_state
+                or (change.flag and change.flag not in buttons)
+            ):
+                stale.append(change)
+            else:
+                valid[change.pk] = prop
+        return valid, stale
+
+    def execute(self, user, meeting) -> tuple[int, int, list[PlannedChange]]:
+        """
+        Apply changes that are still valid. Returns transitioned and flagged count plus stale changes.
+        """
+        props, stale = self.check(meeting)
+        by_transition = defaultdict(list)
+        by_flag = defaultdict(list)
+        for change in self.changes:
+            if prop := props.get(change.pk):
+                by_transition[change.transition].append(prop)
+                if change.flag:
+                    by_flag[change.flag].append(prop)
+        flagged = 0
+        with set_actor(user):
+            for transition, items in by_transition.items():
+                bulk_transition(items, transition, actor=user)
+            for button_pk, items in by_flag.items():
+                flag_btn = meeting.reaction_buttons.get(pk=button_pk)
+                table = ReactionTable.load(
+                    Proposal.objects.filter(pk__in=[x.pk for x in items]), [flag_btn]
+                )
+                flagged += len(
+                    bulk_create(
+                        Reaction,
+                        mk_flag_reactions(flag_btn, items, user, table),
+                        actor=user,
+                    )
+                )
+        return len(props), flagged, stale
@@ -0,0 +1,181 @@
+from __future__ import annotations
+
+import json
+import os
+from collections.abc import Callable
+
+from django.db import models
+
+from voteit.poll.app.polls.combined_simple import CombinedSimple
+from voteit.poll.models import Poll
+
+# Poll method name -> function turning a polls result_data into export columns
+FLATTENERS: dict[str, Callable[[Poll, list], dict]] = {}
+
+
+class ResultDataError(ValueError):
+    """
+    A polls result_data doesn't have the shape its flattener expects.
+    """
+
+    def __init__(self, poll: Poll, msg: str):
+        super().__init__(f"Poll {poll.pk} ({poll.method_name}): {msg}")
+
+
+def flattener(*method_names: str):
+    """
+    Register a result flattener for poll methods. It's called with the poll and its
+    proposals, and returns a list per column with one value for each proposal.
+    It should raise ResultDataError if result_data doesn't look as expected.
+    """
+
+    def register(func):
+        for name in method_names:
+            FLATTENERS[name] = func
+        return func
+
+    return register
+
+
+def get_flatteners() -> dict[str, Callable[[Poll, list], dict]]:
+    """
+    Flatteners for the poll methods in VoteITs registry, by method name.
+    Registry methods without a flattener are left out, so callers can refuse their polls.
+    """
+    from voteit.poll.utils import get_poll_method_registry
+
+    return {
+        name: FLATTENERS[name]
+        for name in get_poll_method_registry()
+        if name in FLATTENERS
+    }
+
+
+@flattener(CombinedSimple.name)
+def flatten_simple(poll: Poll, proposals: list) -> dict:
+    try:
+        results = poll.result_data["results"]
+        prop_results = [results[str(prop.pk)] for prop in proposals]
+        return {
+            "yes": [x["yes"] for x in prop_results],
+            "no": [x["no"] for x in prop_results],
+            "abstain": [x["abstain"] for x in prop_results],
+        }
+    except (KeyError, TypeError) as exc:
+        raise ResultDataError(poll, f"missing {exc} in result_data") from exc
+
+
+def iter_poll_proposals(poll_qs: models.QuerySet, *fields: str, chunk_size=2000):
+    """
+    Yield (poll, proposal pks) for the polls in poll_qs, ordered by poll pk.
+    Only the pk and fields are loaded on the polls.
+    Polls and their proposal relations are read with two server side cursors and merged,
+    so memory stays bounded regardless of how many polls there are.
+    """
+    through = Poll._meta.get_field("proposals").remote_field.through
+    polls = poll_qs.order_by("pk").only("pk", *fields).iterator(chunk_size=chunk_size)
+    relations = (
+        through.objects.filter(poll__in=poll_qs.values("pk"))
+        .order_by("poll_id", "proposal_id")
+        .values_list("poll_id", "proposal_id")
+        .iterator(chunk_size=chunk_size)
+    )
+    relation = next(relations, None)
+    for poll in polls:
+        # Relations for polls before this one can't exist, but skip them to be safe
+        while relation and relation[0] < poll.pk:
+            relation = next(relations, None)
+        proposal_pks = []
+        while relation and relation[0] == poll.pk:
+            proposal_pks.append(relation[1])
+            relation = next(relations, None)
+        yield poll, proposal_pks
+
+
+def get_voter_weight_model() -> type[models.Model]:
+    register_model = Poll._meta.get_field("electoral_register").related_model
+    return register_model._meta.get_field("voterweight").related_model
+
+
+def register_totals(register_ids) -> dict[int, tuple[int, int]]:
+    """
+    Number of voters and total vote weight per electoral register, in one grouped query.
+    Same values as voterweight_set.count() and get_total_vote_weight().
+    """
+    rows = (
+        get_voter_weight_model()
+        .objects.filter(electoral_register__in=set(register_ids))
+        .values("electoral_register")
+        .annotate(voters=models.Count("pk"), weight=models.Sum("weight"))
+        .order_by()
+    )
+    return {x["electoral_register"]: (x["voters"], x["weight"] or 0) for x in rows}
+
+
+class Columns:
+    """
+    Export values kept as one list per field, filled a poll at a time.
+    """
+
+    def __init__(self, names: list[str]):
+        self.names = names
+        self.columns = {x: [] for x in names}
+
+    def __len__(self):
+        return len(self.columns[self.names[0]])
+
+    def extend(self, size: int, **values):
+        """
+        Add size rows. Each value is either a list of size items or one value for all rows.
+        Columns not given are left empty.
+        """
+        for name in self.names:
+            value = values.get(name)
+            if isinstance(value, list):
+                assert len(value) == size, f"{name} has {len(value)} values, not {size}"
+                self.columns[name].extend(value)
+            else:
+                self.columns[name].extend([value] * size)
+
+    def rows(self):
+        return zip(*(self.columns[x] for x in self.names))
+
+    def clear(self):
+        for column in self.columns.values():
+            column.clear()
+
+
+class ExportedPolls:
+    """
+    Pks of polls already in an export file, stored as JSON next to it, so the next
+    run only has to read polls that aren't there yet. Polls finish in any order,
+    so a (started, pk) watermark could skip a poll that finished late.
+    """
+
+    def __init__(self, fn: str):
+        self.fn = f"{fn}.exported"
+        self.data = {}
+        self.pks: set[int] = set()
+        if os.path.exists(self.fn):
+            with open(self.fn) as stream:
+                self.data = json.load(stream)
+            self.pks.update(self.data.pop("polls"))
+
+    def __bool__(self):
+        return bool(self.data)
+
+    def matches(self, **settings) -> bool:
+        return all(self.data.get(k) == v for k, v in settings.items())
+
+    def filter(self, poll_qs: models.QuerySet) -> models.QuerySet:
+        return poll_qs.exclude(pk__in=self.pks)
+
+    def add(self, poll: Poll):
+        self.pks.add(poll.pk)
+
+    def save(self, **settings):
+        self.data = settings
+        tmp = f"{self.fn}.tmp"
+        with open(tmp, "w") as stream:
+            json.dump({**settings, "polls": sorted(self.pks)}, stream)
+        os.replace(tmp, self.fn)
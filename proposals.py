@@ -0,0 +1,251 @@
+from __future__ import annotations
+
+import re
+from functools import reduce
+from operator import or_
+
+from bs4 import BeautifulSoup
+from django.db import IntegrityError
+from django.db import connection
+from django.db import models
+
+from voteit.proposal.models import Proposal
+from voteit.proposal.models import TextParagraph
+
+# First key for pg_advisory_xact_lock, the second is the meeting pk
+PROP_ID_LOCK = 7301
+
+
+class PropIdAllocator:
+    """
+    Hand out prop_ids in memory for proposals created with bulk_create,
+    continuing the '<userid or groupid>-<number>' series within the meeting.
+    Existing ids for all bases are read with one query, holding a transaction level
+    advisory lock for the meeting so concurrent bulk runs wait for each other. Proposals saved the normal way
+    don't take that lock, so check the result with verify() before committing.
+    Must be used within a transaction.
+    """
+
+    def __init__(self, meeting):
+        self.meeting = meeting
+        self.counters: dict[str, int] = {}
+        self.allocated: list[str] = []
+        self.locked = False
+
+    @staticmethod
+    def get_base(author, meeting_group=None) -> str:
+        if meeting_group is not None:
+            return meeting_group.groupid
+        return author.userid
+
+    def load(self, bases):
+        if not (bases := set(bases) - set(self.counters)):
+            return
+        if not self.locked:
+            # An advisory lock only blocks other allocators, not writes that
+            # reference the meeting row like a row lock would
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT pg_advisory_xact_lock(%s, %s)",
+                    [PROP_ID_LOCK, self.meeting.pk],
+                )
+            self.locked = True
+        for base in bases:
+            self.counters[base] = 0
+        patterns = {base: re.compile(rf"^{re.escape(base)}-(\d+)$") for base in bases}
+        for prop_id in Proposal.objects.filter(
+            reduce(or_, (models.Q(prop_id__startswith=f"{x}-") for x in bases)),
+            agenda_item__meeting=self.meeting,
+        ).values_list("prop_id", flat=True):
+            for base, pattern in patterns.items():
+                if match := pattern.match(prop_id):
+                    self.counters[base] = max(self.counters[base], int(match.group(1)))
+
+    def next(self, base: str) -> str:
+        self.load([base])
+        self.counters[base] += 1
+        prop_id = f"{base}-{self.counters[base]}"
+        self.allocated.append(prop_id)
+        return prop_id
+
+    def verify(self):
+        """
+        Raise IntegrityError if any allocated prop_id is used more than once in the
+        meeting, for instance by a proposal submitted while allocating.
+        """
+        if not self.allocated:
+            return
+        duplicates = (
+            Proposal.objects.filter(
+                agenda_item__meeting=self.meeting, prop_id__in=self.allocated
+            )
+            .values("prop_id")
+            .annotate(count=models.Count("pk"))
+            .filter(count__gt=1)
+            .values_list("prop_id", flat=True)
+        )
+        if duplicates := list(duplicates):
+            raise IntegrityError(f"Duplicate prop_ids: {', '.join(duplicates)}")
+
+
+def body_tags(body: str) -> list[str]:
+    """
+    Hashtags in a proposal body, in order. Proposal.save() keeps these in tags.
+    """
+    tags = []
+    soup = BeautifulSoup(body, features="lxml")
+    for hit in soup.find_all(name="span", attrs={"data-denotation-char": "#"}):
+        if (tag := hit.get("data-id")) and tag not in tags:
+            tags.append(tag)
+    return tags
+
+
+def mk_proposal(
+    allocator: PropIdAllocator,
+    agenda_item_id: int,
+    body: str,
+    author,
+    meeting_group=None,
+) -> Proposal:
+    """
+    Unsaved proposal with the fields save() would otherwise derive:
+    prop_id, and tags with the prop_id and the hashtags in body.
+    """
+    prop_id = allocator.next(PropIdAllocator.get_base(author, meeting_group))
+    kwargs = {}
+    if meeting_group is not None:
+        kwargs.update({"meeting_group": meeting_group, "as_group": True})
+    return Proposal(
+        agenda_item_id=agenda_item_id,
+        author=author,
+        body=body,
+        prop_id=prop_id,
+        tags=[prop_id, *(x for x in body_tags(body) if x != prop_id)],
+        **kwargs,
+    )
+
+
+# Fields the report templates use from GenericProposalSerializer
+ROW_FIELDS = (
+    "pk",
+    "prop_id",
+    "state",
+    "body",
+    "tags",
+    "author",
+    "meeting_group",
+    "agenda_item",
+    "paragraph",
+    "body_diff_brief",
+)
+
+
+def proposal_row(prop: Proposal) -> dict:
+    """
+    Same values as GenericProposalSerializer gives for ROW_FIELDS,
+    read straight from the instance without serializer overhead.
+    Subclass fields (paragraph, body_diff_brief) are None for plain proposals.
+    """
+    return {
+        "pk": prop.pk,
+        "prop_id": prop.prop_id,
+        "state": prop.state,
+        "body": prop.body,
+        "tags": list(prop.tags),
+        "author": prop.author_id,
+        "meeting_group": prop.meeting_group_id,
+        "agenda_item": prop.agenda_item_id,
+        "paragraph": getattr(prop, "paragraph_id", None),
+        "body_diff_brief": getattr(prop, "body_diff_brief", None),
+    }
+
+
+def paragraph_lookups() -> list[str]:
+    """
+    Lookups from Proposal to the paragraph of each subclass that has one.
+    """
+    lookups = []
+    for rel in Proposal._meta.related_objects:
+        if not (rel.one_to_one and issubclass(rel.related_model, Proposal)):
+            continue
+        for field in rel.related_model._meta.local_fields:
+            if field.is_relation and field.related_model is TextParagraph:
+                lookups.append(f"{rel.name}__{field.name}")
+    return lookups
+
+
+def proposal_context_maps(meeting, prop_qs: models.QuerySet) -> tuple[dict, dict, dict]:
+    """
+    Groups, users and paragraph tags referenced by the proposals in prop_qs,
+    as the maps proposal_context needs. The ids are read in one pass over prop_qs.
+    prop_qs must be a plain queryset, without select_subclasses.
+    """
+    lookups = paragraph_lookups()
+    group_ids, user_ids, paragraph_ids = set(), set(), set()
+    for author_id, group_id, *paragraphs in prop_qs.values_list(
+        "author_id", "meeting_group_id", *lookups
+    ).order_by():
+        user_ids.add(author_id)
+        group_ids.add(group_id)
+        paragraph_ids.update(paragraphs)
+    group_ids.discard(None)
+    user_ids.discard(None)
+    paragraph_ids.discard(None)
+    meeting_groups_map = {}
+    if group_ids:
+        meeting_groups_map = {x.pk: x for x in meeting.groups.filter(pk__in=group_ids)}
+    users_map = {}
+    if user_ids:
+        users_map = {x.pk: x for x in meeting.participants.filter(pk__in=user_ids)}
+    paragraph_tag_map = {}
+    if paragraph_ids:
+        paragraph_tag_map = dict(
+            TextParagraph.objects.filter(pk__in=paragraph_ids).values_list("pk", "tag")
+        )
+    return meeting_groups_map, users_map, paragraph_tag_map
+
+
+def proposal_context(
+    prop: Proposal, meeting_groups_map: dict, users_map: dict, paragraph_tag_map: dict
+) -> dict:
+    """
+    Template context for a proposal, with group, author and paragraph tag joined in.
+    """
+    data = proposal_row(prop)
+    data["meeting_group"] = meeting_groups_map.get(data["meeting_group"])
+    try:
+        data["author"] = users_map[data["author"]]
+    except KeyError:
+        data["author"] = {
+            "userid": "",
+            "get_full_name": "(Removed user)",
+        }
+    if data["paragraph"] in paragraph_tag_map:
+        data["ptag"] = paragraph_tag_map[data["paragraph"]]
+    # Adjust tags and remove prop id
+    if prop.prop_id in data["tags"]:
+        data["tags"].remove(prop.prop_id)
+    return data
+
+
+def check_row_parity(props) -> list[str]:
+    """
+    Compare proposal_row with GenericProposalSerializer and return differences.
+    A field in ROW_FIELDS that the serializer doesn't give is a difference too.
+    """
+    from voteit.proposal.rest_api.serializers import GenericProposalSerializer
+
+    errors = []
+    for prop in props:
+        row = proposal_row(prop)
+        data = GenericProposalSerializer(prop).data
+        for name in ROW_FIELDS:
+            if name not in data:
+                errors.append(f"{prop.prop_id} {name}: missing from serializer")
+                continue
+            expected = data[name]
+            if name == "tags" and expected is not None:
+                expected = list(expected)
+            if row[name] != expected:
+                errors.append(f"{prop.prop_id} {name}: {row[name]!r} != {expected!r}")
+    return errors
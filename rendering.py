@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+from collections.abc import Callable
+
+from django.template import Context
+from django.template.loader import get_template
+
+CONTENT_MARKER = "<!-- voteit_tools:content -->"
+
+
+class Renderer:
+    """
+    Look up each template once and render with one reused Context,
+    instead of render_to_string doing both for every call.
+    """
+
+    def __init__(self):
+        self.templates = {}
+        self.context = Context()
+
+    def get_template(self, template_name: str):
+        try:
+            return self.templates[template_name]
+        except KeyError:
+            template = self.templates[template_name] = get_template(
+                template_name
+            ).template
+            return template
+
+    def render(self, template_name: str, context: dict) -> str:
+        template = self.get_template(template_name)
+        with self.context.push(context):
+            return template.render(self.context)
+
+    def split(self, template_name: str, context: dict, key: str) -> tuple[str, str]:
+        """
+        Render a page template with a marker as the only item in key,
+        and return what goes before and after it. Used to stream the content in between.
+        """
+        page = self.render(template_name, {**context, key: [CONTENT_MARKER]})
+        header, footer = page.split(CONTENT_MARKER)
+        return header, footer
+
+
+class ChunkedWriter:
+    """
+    Collect small writes and pass them on in chunks of about size characters.
+    """
+
+    def __init__(self, write: Callable[[str], object], size: int = 64 * 1024):
+        self._write = write
+        self.size = size
+        self.buffer = []
+        self.length = 0
+
+    def write(self, txt: str):
+        self.buffer.append(txt)
+        self.length += len(txt)
+        if self.length >= self.size:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self._write("".join(self.buffer))
+            self.buffer = []
+            self.length = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
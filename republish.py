@@ -0,0 +1,148 @@
+from __future__ import annotations
+
+from logging import getLogger
+from time import sleep
+
+from auditlog.context import set_actor
+from django.contrib.contenttypes.models import ContentType
+from django.db import DatabaseError
+from django.db import close_old_connections
+from django.db import models
+from django.db import transaction
+
+from voteit.proposal.models import Proposal
+from voteit.reactions.models import Reaction
+from voteit.reactions.models import ReactionButton
+from voteit_tools.bulk import bulk_create
+from voteit_tools.bulk import bulk_transition
+from voteit_tools.chunks import chunked
+from voteit_tools.plan import Plan
+from voteit_tools.thresholds import ReactionTable
+from voteit_tools.thresholds import mk_flag_reactions
+
+logger = getLogger(__name__)
+
+
+class Republish:
+    """
+    Publish proposals with reactions over the buttons target,
+    and optionally flag the ones that changed state.
+    """
+
+    # Reaction pks below the watermark that are read again in watch mode
+    RESCAN_WINDOW = 1000
+
+    def __init__(
+        self, target_btn: ReactionButton, flag_btn: ReactionButton | None, user
+    ):
+        self.target_btn = target_btn
+        self.flag_btn = flag_btn
+        self.user = user
+
+    def find(self, prop_qs: models.QuerySet) -> tuple[list[Proposal], ReactionTable]:
+        table = ReactionTable.load(prop_qs, [self.target_btn, self.flag_btn])
+        props = list(prop_qs.filter(pk__in=table.over_target(self.target_btn)))
+        return props, table
+
+    def apply(self, props: list[Proposal], table: ReactionTable) -> list[Reaction]:
+        with set_actor(self.user):
+            bulk_transition(props, "publish", actor=self.user)
+            if not self.flag_btn:
+                return []
+            return bulk_create(
+                Reaction,
+                mk_flag_reactions(self.flag_btn, props, self.user, table),
+                actor=self.user,
+            )
+
+    def run(self, prop_qs: models.QuerySet) -> tuple[list[Proposal], list[Reaction]]:
+        props, table = self.find(prop_qs)
+        return props, self.apply(props, table)
+
+    def plan(self, prop_qs: models.QuerySet, command: str, meeting) -> Plan:
+        props, table = self.find(prop_qs)
+        flagged = table.has_any(self.flag_btn) if self.flag_btn else set()
+        plan = Plan(command=command, meeting=meeting.pk)
+        for prop in props:
+            plan.add(
+                prop, "publish", flag=None if prop.pk in flagged else self.flag_btn
+            )
+        return plan
+
+    def watermark(self) -> int:
+        return self.target_btn.reactions.aggregate(models.Max("pk"))["pk__max"] or 0
+
+    def reacted_since(self, watermark: int, seen: set[int]) -> tuple[int, set[int]]:
+        """
+        New watermark and pks of proposals with target reactions newer than watermark.
+        A reaction can commit after one with a higher pk has been read, so the last
+        RESCAN_WINDOW pks below the watermark are read again. Reaction pks in seen
+        are skipped, and seen is updated and pruned to the window.
+        """
+        low = max(watermark - self.RESCAN_WINDOW, 0)
+        # Read everything before touching seen, so a failed read changes nothing
+        rows = list(
+            self.target_btn.reactions.filter(
+                pk__gt=low,
+                content_type=ContentType.objects.get_for_model(Proposal),
+            ).values_list("pk", "object_id")
+        )
+        pks = set()
+        for pk, object_id in rows:
+            watermark = max(watermark, pk)
+            if pk not in seen:
+                seen.add(pk)
+                pks.add(object_id)
+        low = watermark - self.RESCAN_WINDOW
+        seen.difference_update([x for x in seen if x <= low])
+        return watermark, pks
+
+    def watch(
+        self,
+        prop_qs: models.QuerySet,
+        watermark: int,
+        interval: float,
+        batch_size: int,
+        on_error=None,
+    ):
+        """
+        Poll for reactions newer than watermark and only check the proposals they concern.
+        Each batch is committed on its own. Yields (props, flagged) per batch.
+        Database errors are logged and passed to on_error, and the proposals
+        of a failed batch are checked again on the next poll.
+        """
+        # Reactions at or below the starting watermark were handled by the first run
+        seen = set(
+            self.target_btn.reactions.filter(
+                pk__gt=watermark - self.RESCAN_WINDOW, pk__lte=watermark
+            ).values_list("pk", flat=True)
+        )
+        retry = set()
+        while True:
+            # Drop connections the database closed or that are past CONN_MAX_AGE
+            close_old_connections()
+            try:
+                watermark, pks = self.reacted_since(watermark, seen)
+            except DatabaseError as exc:
+                self._error(exc, on_error)
+                sleep(interval)
+                continue
+            pks |= retry
+            retry = set()
+            for chunk in chunked(sorted(pks), batch_size):
+                try:
+                    with transaction.atomic(durable=True):
+                        props, flagged = self.run(prop_qs.filter(pk__in=chunk))
+                except DatabaseError as exc:
+                    self._error(exc, on_error)
+                    retry.update(chunk)
+                    continue
+                if props:
+                    yield props, flagged
+            sleep(interval)
+
+    @staticmethod
+    def _error(exc: Exception, on_error):
+        logger.exception("Republish watch failed: %s", exc)
+        if on_error:
+            on_error(exc)
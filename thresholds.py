@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+from collections import defaultdict
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import models
+
+from voteit.proposal.models import Proposal
+from voteit.reactions.models import Reaction
+from voteit.reactions.models import ReactionButton
+
+
+class ReactionTable:
+    """
+    Reaction counts per proposal and button, loaded with one grouped query.
+    Rules are answered as set operations on proposal pks.
+    """
+
+    def __init__(self, counts: dict[int, dict[int, int]] | None = None):
+        # button pk -> proposal pk -> count
+        self.counts = counts or {}
+
+    @classmethod
+    def load(cls, prop_qs: models.QuerySet, buttons) -> ReactionTable:
+        button_pks = {_pk(x) for x in buttons if x is not None}
+        counts = defaultdict(dict)
+        if button_pks:
+            for row in (
+                Reaction.objects.filter(
+                    button__in=button_pks,
+                    object_id__in=prop_qs.values("pk"),
+                    content_type=ContentType.objects.get_for_model(Proposal),
+                )
+                .values("button", "object_id")
+                .annotate(count=models.Count("pk"))
+                .order_by()
+            ):
+                counts[row["button"]][row["object_id"]] = row["count"]
+        return cls(dict(counts))
+
+    def count(self, prop_pk: int, button) -> int:
+        return self.counts.get(_pk(button), {}).get(prop_pk, 0)
+
+    def over_target(self, button: ReactionButton) -> set[int]:
+        assert button.target, f"{button} has no target"
+        return {
+            pk
+            for pk, count in self.counts.get(button.pk, {}).items()
+            if count >= button.target
+        }
+
+    def has_any(self, *buttons) -> set[int]:
+        """
+        Proposals with at least one reaction from any of the buttons.
+        For flag mode buttons that means flagged.
+        """
+        found = set()
+        for button in buttons:
+            found.update(self.counts.get(_pk(button), {}))
+        return found
+
+
+def _pk(button) -> int:
+    return button.pk if isinstance(button, ReactionButton) else int(button)
+
+
+def mk_flag_reactions(
+    flag_btn: ReactionButton, props, user, table: ReactionTable
+) -> list[Reaction]:
+    """
+    Unsaved flag reactions for proposals that aren't flagged already.
+    """
+    flagged = table.has_any(flag_btn)
+    content_type = ContentType.objects.get_for_model(Proposal)
+    return [
+        Reaction(
+            button=flag_btn,
+            content_type=content_type,
+            object_id=prop.pk,
+            user=user,
+            agenda_item_id=prop.agenda_item_id,
+        )
+        for prop in props
+        if prop.pk not in flagged
+    ]
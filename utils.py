@@ -1,8 +1,21 @@
+from __future__ import annotations
+
+import cProfile
+import io
+import json
+import os
+import pstats
+import threading
+import tracemalloc
+from contextlib import ExitStack
 from contextlib import contextmanager
+from dataclasses import dataclass
+from dataclasses import field
 from datetime import date
 from functools import reduce
 from time import perf_counter
 
+from django.db import connection
 from django.db import models
 from django.template.loader import render_to_string
 
@@ -20,6 +33,159 @@ def exectime() -> float:
     yield lambda: perf_counter() - start
 
 
+@dataclass
+class Span:
+    name: str
+    start: float
+    end: float | None = None
+    queries: int = 0
+    memory: int | None = None
+    memory_peak: int | None = None
+    profile: str = ""
+    traced_peak: int = field(default=0, repr=False)
+    children: list[Span] = field(default_factory=list)
+
+    @property
+    def duration(self) -> float:
+        return (self.end or perf_counter()) - self.start
+
+    def walk(self, depth: int = 0):
+        yield depth, self
+        for child in self.children:
+            yield from child.walk(depth + 1)
+
+
+class Tracer:
+    """
+    Collect named, nested spans with wall time, query count and optionally
+    allocated memory (tracemalloc) and a cProfile summary.
+
+    >>> tracer = Tracer()
+    >>> with tracer.span("outer"):
+    ...     with tracer.span("inner"):
+    ...         pass
+    """
+
+    def __init__(self, memory: bool = False, profile: int = 0):
+        self.memory = memory
+        # Number of hot functions to keep from cProfile, 0 for no profiling
+        self.profile = profile
+        self.spans: list[Span] = []
+        self._stack: list[Span] = []
+
+    @contextmanager
+    def span(self, name: str) -> Span:
+        span = Span(name=name, start=perf_counter())
+        if self._stack:
+            self._stack[-1].children.append(span)
+        else:
+            self.spans.append(span)
+        with ExitStack() as stack:
+            stack.enter_context(connection.execute_wrapper(self._counter(span)))
+            if self.memory:
+                stack.enter_context(self._trace_memory(span))
+            # cProfile can't nest, so only the outermost span is profiled
+            if self.profile and not self._stack:
+                stack.enter_context(self._profile(span))
+            self._stack.append(span)
+            try:
+                yield span
+            finally:
+                self._stack.pop()
+                span.end = perf_counter()
+
+    @staticmethod
+    def _counter(span: Span):
+        def wrapper(execute, sql, params, many, context):
+            span.queries += 1
+            return execute(sql, params, many, context)
+
+        return wrapper
+
+    @contextmanager
+    def _trace_memory(self, span: Span):
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start()
+        before, parent_peak = tracemalloc.get_traced_memory()
+        # Keep the peak the parent reached so far, the reset below discards it
+        if self._stack:
+            parent = self._stack[-1]
+            parent.traced_peak = max(parent.traced_peak, parent_peak)
+        tracemalloc.reset_peak()
+        try:
+            yield
+        finally:
+            after, peak = tracemalloc.get_traced_memory()
+            # Nested spans reset the peak, so include theirs and what was folded in before them
+            peak = max(
+                [peak, span.traced_peak] + [c.traced_peak for c in span.children]
+            )
+            span.traced_peak = peak
+            span.memory = after - before
+            span.memory_peak = peak - before
+            if started:
+                tracemalloc.stop()
+
+    @contextmanager
+    def _profile(self, span: Span):
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            out = io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats(
+                pstats.SortKey.CUMULATIVE
+            ).print_stats(self.profile)
+            span.profile = out.getvalue()
+
+    def report(self) -> str:
+        lines = []
+        for root in self.spans:
+            for depth, span in root.walk():
+                line = (
+                    "  " * depth
+                    + f"{span.name}: {span.duration:.4f} secs - Queries: {span.queries}"
+                )
+                if span.memory is not None:
+                    line += f" - Memory: {span.memory:,} (peak {span.memory_peak:,})"
+                lines.append(line)
+                if span.profile:
+                    lines.append(span.profile)
+        return "\n".join(lines)
+
+    def chrome_trace(self) -> dict:
+        """
+        Trace event format, open with chrome://tracing or https://ui.perfetto.dev
+        """
+        pid, tid = os.getpid(), threading.get_ident()
+        events = []
+        for root in self.spans:
+            for _, span in root.walk():
+                args = {"queries": span.queries}
+                if span.memory is not None:
+                    args["memory"] = span.memory
+                    args["memory_peak"] = span.memory_peak
+                events.append(
+                    {
+                        "name": span.name,
+                        "ph": "X",
+                        "ts": span.start * 1_000_000,
+                        "dur": span.duration * 1_000_000,
+                        "pid": pid,
+                        "tid": tid,
+                        "args": args,
+                    }
+                )
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write_chrome_trace(self, fn: str):
+        with open(fn, "w") as stream:
+            json.dump(self.chrome_trace(), stream)
+
+
 def render_org_stats(
     organisation: Organisation, year: int, lmeeting: int = 500, smeeting: int = 15
 ) -> str:
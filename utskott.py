@@ -0,0 +1,344 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+from dataclasses import dataclass
+from dataclasses import field
+from dataclasses import fields
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import models
+
+from voteit.discussion.models import DiscussionPost
+from voteit.meeting.models import Meeting
+from voteit.proposal.models import Proposal
+from voteit.proposal.models import TextParagraph
+from voteit.proposal.workflows import ProposalWf
+from voteit.reactions.models import Reaction
+from voteit_tools.proposals import proposal_context
+from voteit_tools.rendering import ChunkedWriter
+from voteit_tools.rendering import Renderer
+
+PROPOSAL_WF_STATES = set(ProposalWf.states) - {ProposalWf.RETRACTED}
+
+
+@dataclass
+class Committee:
+    """
+    Settings for one committee protocol. The first button is the committee's main proposal flag.
+    """
+
+    buttons: list[int]
+    tags: list[str] = field(default_factory=list)
+    group: str | None = None
+    all_btns: bool = False
+    output: str | None = None
+    name: str = ""
+    cache: str | None = None
+
+
+def read_committees(fn: str) -> list[Committee]:
+    with open(fn) as stream:
+        if fn.endswith((".yaml", ".yml")):
+            try:
+                import yaml
+            except ImportError:
+                exit("Install pyyaml to read YAML files")
+            items = yaml.safe_load(stream)
+        else:
+            items = json.load(stream)
+    if not isinstance(items, list):
+        exit(f"{fn} should contain a list of committees")
+    names = {f.name for f in fields(Committee)}
+    committees = []
+    for i, item in enumerate(items, start=1):
+        if not isinstance(item, dict):
+            exit(f"Committee {i} in {fn} isn't a mapping")
+        if unknown := set(item) - names:
+            exit(
+                f"Committee {i} in {fn} has unknown keys: {', '.join(sorted(unknown))}. "
+                f"Valid keys are {', '.join(sorted(names))}"
+            )
+        if not item.get("buttons"):
+            exit(f"Committee {i} in {fn} needs buttons")
+        committee = Committee(**item)
+        committee.name = committee.name or f"utskott-{i}"
+        committee.output = committee.output or f"{committee.name}.html"
+        committees.append(committee)
+    return committees
+
+
+class SectionCache:
+    """
+    Rendered agenda item sections stored as JSON, with the hash of the inputs they were rendered from.
+    Sections not used in a run are dropped when saving.
+    """
+
+    def __init__(self, fn: str):
+        self.fn = fn
+        self.sections = {}
+        self.used = {}
+        self.reused = 0
+        if os.path.exists(fn):
+            with open(fn) as stream:
+                self.sections = json.load(stream)
+
+    def get(self, ai_pk: int, key: str) -> str | None:
+        found = self.sections.get(str(ai_pk))
+        if found and found[0] == key:
+            self.reused += 1
+            self.used[str(ai_pk)] = found
+            return found[1]
+
+    def set(self, ai_pk: int, key: str, html: str):
+        self.used[str(ai_pk)] = [key, html]
+
+    def save(self):
+        tmp = f"{self.fn}.tmp"
+        with open(tmp, "w") as stream:
+            json.dump(self.used, stream)
+        os.replace(tmp, self.fn)
+
+
+class UtskottData:
+    """
+    Everything needed to render committee protocols for the agenda items,
+    loaded in a fixed number of queries and shared between committees.
+    """
+
+    def __init__(self, meeting: Meeting, ais: list, groupids=()):
+        self.meeting = meeting
+        self.ais = ais
+        self.buttons = {
+            x["pk"]: dict(x)
+            for x in meeting.reaction_buttons.values(
+                "pk", "title", "flag_mode", "target", "color"
+            )
+        }
+        self.groups = {x.pk: x for x in meeting.groups.all()}
+        self.groups_by_groupid = {x.groupid: x for x in self.groups.values()}
+        # Proposal pk -> [(button pk, count)]
+        self.reactions = {}
+        for row in (
+            Reaction.objects.filter(
+                agenda_item__in=ais,
+                content_type=ContentType.objects.get_for_model(Proposal),
+            )
+            .values("object_id", "button")
+            .annotate(count=models.Count("pk"))
+            .order_by()
+        ):
+            self.reactions.setdefault(row["object_id"], []).append(
+                (row["button"], row["count"])
+            )
+        self.ai_props = {}
+        for prop in (
+            Proposal.objects.filter(agenda_item__in=ais, state__in=PROPOSAL_WF_STATES)
+            .select_subclasses()
+            .order_by("agenda_item_id", "created")
+        ):
+            self.ai_props.setdefault(prop.agenda_item_id, []).append(prop)
+        self.props = [x for props in self.ai_props.values() for x in props]
+        self.users = {
+            x.pk: x
+            for x in meeting.participants.filter(
+                pk__in={x.author_id for x in self.props}
+            )
+        }
+        self.paragraph_tags = dict(
+            TextParagraph.objects.filter(agenda_item__in=ais).values_list("pk", "tag")
+        )
+        # (group pk, agenda item pk, prop_id) -> discussion posts
+        self.discussions = {}
+        # Unknown groupids are reported by validate()
+        groups = [
+            self.groups_by_groupid[x] for x in groupids if x in self.groups_by_groupid
+        ]
+        if groups and self.props:
+            prop_ids = {x.prop_id for x in self.props}
+            for discussion in DiscussionPost.objects.filter(
+                agenda_item__in=ais,
+                meeting_group__in=groups,
+                tags__overlap=list(prop_ids),
+            ).order_by("created"):
+                for tag in prop_ids.intersection(discussion.tags):
+                    self.discussions.setdefault(
+                        (discussion.meeting_group_id, discussion.agenda_item_id, tag),
+                        [],
+                    ).append(discussion)
+
+    def validate(self, committee: Committee) -> str | None:
+        if missing := set(committee.buttons) - set(self.buttons):
+            return "The following button pks aren't valid for this meeting: %s" % (
+                ", ".join(str(x) for x in missing)
+            )
+        if not self.buttons[committee.buttons[0]]["flag_mode"]:
+            return "Utskottets knapp måste vara flagga"
+        if committee.group and committee.group not in self.groups_by_groupid:
+            return f"Mötesgruppen {committee.group} finns inte"
+
+    def committee_ais(self, committee: Committee) -> list:
+        if not committee.tags:
+            return self.ais
+        tags = set(committee.tags)
+        return [x for x in self.ais if tags.intersection(x.tags)]
+
+    def btn_map(self, committee: Committee) -> dict:
+        if committee.all_btns:
+            return self.buttons
+        return {x: self.buttons[x] for x in committee.buttons}
+
+    def section_key(self, renderer: Renderer, committee: Committee, ai) -> str:
+        """
+        Hash of everything an agenda item section is rendered from: the values
+        passed to the templates, not ids or modified times.
+        """
+        btn_map = self.btn_map(committee)
+        group = self.groups_by_groupid.get(committee.group)
+        props = []
+        for prop in self.ai_props.get(ai.pk, []):
+            data = proposal_context(prop, self.groups, self.users, self.paragraph_tags)
+            author = data["author"]
+            if isinstance(author, dict):
+                data["author"] = [author["userid"], author["get_full_name"]]
+            else:
+                data["author"] = [author.userid, author.get_full_name()]
+            if data["meeting_group"] is not None:
+                data["meeting_group"] = str(data["meeting_group"])
+            data["reactions"] = [
+                x for x in self.reactions.get(prop.pk, []) if x[0] in btn_map
+            ]
+            if group:
+                data["discussions"] = [
+                    x.body
+                    for x in self.discussions.get((group.pk, ai.pk, prop.prop_id), [])
+                ]
+            props.append(data)
+        inputs = (
+            ai.pk,
+            ai.title,
+            committee.buttons[0],
+            sorted(btn_map.items()),
+            committee.group,
+            props,
+            [
+                renderer.get_template(x).source
+                for x in ("mp_utskott/ai.html", "mp_utskott/proposal.html")
+            ],
+        )
+        return hashlib.sha256(
+            json.dumps(inputs, default=str).encode("utf-8")
+        ).hexdigest()
+
+    def render(
+        self, committee: Committee, write, renderer: Renderer | None = None
+    ) -> tuple[int, int]:
+        """
+        Write the committee protocol. With committee.cache, unchanged agenda item sections are reused.
+        Returns number of sections rendered and reused.
+        """
+        renderer = renderer or Renderer()
+        cache = SectionCache(committee.cache) if committee.cache else None
+        header, footer = renderer.split(
+            "mp_utskott/utskott.html",
+            {"title": f"Utskottsprotokoll från {self.meeting.title}"},
+            "rendered_ais",
+        )
+        rendered = 0
+        with ChunkedWriter(write) as out:
+            out.write(header)
+            for ai in self.committee_ais(committee):
+                if cache is None:
+                    html = self.render_ai(renderer, committee, ai)
+                    rendered += 1
+                else:
+                    key = self.section_key(renderer, committee, ai)
+                    if (html := cache.get(ai.pk, key)) is None:
+                        html = self.render_ai(renderer, committee, ai)
+                        cache.set(ai.pk, key, html)
+                        rendered += 1
+                out.write(html)
+            out.write(footer)
+        if cache:
+            cache.save()
+            return rendered, cache.reused
+        return rendered, 0
+
+    def render_ai(self, renderer: Renderer, committee: Committee, ai) -> str:
+        utskottets_btn_pk = committee.buttons[0]
+        btn_map = self.btn_map(committee)
+        group = self.groups_by_groupid.get(committee.group)
+        selected_proposals_rendered = []
+        other_proposals_rendered = []
+        for prop in self.ai_props.get(ai.pk, []):
+            data = proposal_context(prop, self.groups, self.users, self.paragraph_tags)
+            data["reactions"] = [
+                {"object_id": prop.pk, "button": btn_map[button], "count": count}
+                for button, count in self.reactions.get(prop.pk, [])
+                if button in btn_map
+            ]
+            # And attach group comments regarding this
+            if group:
+                data["discussions"] = self.discussions.get(
+                    (group.pk, ai.pk, prop.prop_id), []
+                )
+
+            data["utskottets"] = False
+            for i, button in enumerate(data["reactions"]):
+                if button["button"]["pk"] == utskottets_btn_pk:
+                    data["utskottets"] = bool(button["count"])
+                    data["popitem"] = i
+                    break
+            if data["utskottets"]:
+                # Remove reaction button corresponding to group
+                data["reactions"].pop(data.pop("popitem"))
+                selected_proposals_rendered.append(
+                    renderer.render("mp_utskott/proposal.html", {"proposal": data})
+                )
+            else:
+                other_proposals_rendered.append(
+                    renderer.render("mp_utskott/proposal.html", {"proposal": data})
+                )
+
+        return renderer.render(
+            "mp_utskott/ai.html",
+            {
+                "agenda_item": ai,
+                "selected_proposals": selected_proposals_rendered,
+                "other_proposals": other_proposals_rendered,
+            },
+        )
+
+
+# Set in the parent before forking workers, so they share it without pickling
+_worker_data: UtskottData | None = None
+
+
+def render_to_file(data: UtskottData, committee: Committee) -> tuple[int, int]:
+    with open(committee.output, "w") as stream:
+        return data.render(committee, stream.write)
+
+
+def _render_worker(committee: Committee) -> tuple[Committee, tuple[int, int]]:
+    return committee, render_to_file(_worker_data, committee)
+
+
+def render_parallel(data: UtskottData, committees: list[Committee], workers: int):
+    """
+    Render each committee to its output file in a pool of forked processes.
+    Yields (committee, (rendered, reused)) as they finish.
+    """
+    from multiprocessing import get_context
+
+    from django.db import connections
+
+    global _worker_data
+    _worker_data = data
+    # Forked children must not share the parents database connections
+    connections.close_all()
+    try:
+        with get_context("fork").Pool(workers) as pool:
+            yield from pool.imap_unordered(_render_worker, committees)
+    finally:
+        _worker_data = None